@@ -0,0 +1,100 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# 壓測用的假 Azure OpenAI 服務：實作 chat completions（含串流），不連外、不計費
+#   FAKE_LLM_LATENCY_MS         收到請求到第一個 token 的延遲
+#   FAKE_LLM_TOKENS_PER_SEC     產生 token 的速度（0 表示不限速）
+#   FAKE_LLM_COMPLETION_TOKENS  每次回覆的 token 數（不超過請求的 max_tokens）
+# 以 `uvicorn bench.fake_llm:app --port 9100` 單獨啟動，或由 bench/run.py 自動啟動
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 300))
+FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", 50))
+FAKE_LLM_COMPLETION_TOKENS = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", 120))
+
+TOKEN = "好"
+# 自動記憶摘要要求固定格式（utils/memory_jobs.py），回覆可解析的內容讓背景工作完整執行
+MEMORY_REPLY = "記憶內容：兩人在咖啡廳聊了今天發生的事\n標籤：日常"
+
+app = FastAPI(title="fake-llm")
+
+
+def _prompt_tokens(messages: list) -> int:
+    # 粗估即可：中文約一字一 token，另加每則訊息的格式開銷
+    return sum(len(m.get("content") or "") + 4 for m in messages)
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+async def _token_delay():
+    if FAKE_LLM_TOKENS_PER_SEC > 0:
+        await asyncio.sleep(1 / FAKE_LLM_TOKENS_PER_SEC)
+
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    completion_tokens = min(FAKE_LLM_COMPLETION_TOKENS, body.get("max_tokens") or FAKE_LLM_COMPLETION_TOKENS)
+    messages = body.get("messages", [])
+    prompt_tokens = _prompt_tokens(messages)
+    if any("記憶內容" in (m.get("content") or "") for m in messages if m.get("role") == "system"):
+        content = MEMORY_REPLY
+    else:
+        content = TOKEN * completion_tokens
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    await asyncio.sleep(FAKE_LLM_LATENCY_MS / 1000)
+
+    if not body.get("stream"):
+        for _ in range(completion_tokens):
+            await _token_delay()
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(prompt_tokens, completion_tokens),
+        }
+
+    def chunk(delta: dict, finish_reason: str | None = None, usage: dict | None = None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+        }
+        if usage:
+            data["usage"] = usage
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def stream():
+        # 與 Azure 相同，第一個 chunk 沒有 choices（內容過濾結果）
+        yield chunk(None)
+        yield chunk({"role": "assistant", "content": ""})
+        for _ in range(completion_tokens):
+            await _token_delay()
+            yield chunk({"content": TOKEN})
+        yield chunk({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=_usage(prompt_tokens, completion_tokens))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+import httpx
+
+# 效能基準測試：以 SQLite 與本機假模型服務（bench/fake_llm.py）啟動應用，
+# 依指定併發量壓測聊天送出 / 串流、歷史訊息、角色列表與登入流程，
+# 輸出 p50 / p95 / p99 延遲與吞吐量，並與儲存的基準比較（退步超過容許範圍時以非 0 結束）
+#
+#   python -m bench.run                         # 執行並與 bench/baseline.json 比較
+#   python -m bench.run --save-baseline         # 執行並把結果存為新的基準
+#   python -m bench.run -c 50 -n 500 --scenarios send,history
+#
+# 基準數值與機器有關，請在同一台機器（或同規格的 CI runner）上產生與比較
+# 注意：tiktoken 第一次使用會下載編碼檔，離線環境需先準備好 TIKTOKEN_CACHE_DIR
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+SCENARIOS = ("send", "stream", "history", "roles", "auth")
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+
+CHAT_PARAMS = {
+    "max_tokens": 200,
+    "temperature": 0.7,
+    "top_p": 1,
+    "presence_penalty": 0,
+    "frequency_penalty": 0,
+}
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "p50_ms": _percentile(ordered, 50),
+            "p95_ms": _percentile(ordered, 95),
+            "p99_ms": _percentile(ordered, 99),
+            "mean_ms": round(statistics.fmean(ordered) * 1000, 1) if ordered else None,
+            "rps": round(len(ordered) / self.elapsed, 1) if self.elapsed else None,
+        }
+
+
+def _percentile(ordered: list[float], p: float) -> float | None:
+    # nearest-rank
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return round(ordered[index] * 1000, 1)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(module: str, port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--no-access-log"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    return subprocess.Popen(cmd, cwd=ROOT, env={**os.environ, **env})
+
+
+async def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} 啟動失敗（exit code {process.returncode}）")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} 未在 {timeout} 秒內啟動")
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.headers: dict = {}
+        self.model_api_id: int | None = None
+        self.session_ids: list[int] = []
+
+    async def _check(self, response: httpx.Response) -> httpx.Response:
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.request.method} {response.request.url.path} -> "
+                               f"{response.status_code} {response.text[:200]}")
+        return response
+
+    async def seed(self, llm_url: str):
+        """
+        建立壓測用的帳號、模型金鑰（指向假模型服務）、角色、每個 worker 各一個對話與歷史訊息
+        """
+        await self.client.post("/auth/register", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+        login = await self._check(await self.client.post(
+            "/auth/login", json={"username": BENCH_USER, "password": BENCH_PASSWORD}
+        ))
+        self.headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        api = await self._check(await self.client.post("/api/model-apis", headers=self.headers, json={
+            "name": "bench",
+            "provider": "azure",
+            "config": {"endpoint": llm_url, "api_key": "bench", "deployment_name": "bench"},
+        }))
+        self.model_api_id = api.json()["id"]
+
+        role = await self._check(await self.client.post("/api/roles/create", headers=self.headers, data={
+            "name": "壓測角色",
+            "personality": "溫柔、有耐心",
+            "speaking_style": "簡短口語",
+            "is_public": "true",
+        }))
+        role_id = role.json()["id"]
+        user_id = (await self._check(await self.client.get("/auth/me", headers=self.headers))).json()["id"]
+
+        for _ in range(self.args.concurrency):
+            session = await self._check(await self.client.post("/api/sessions/", json={
+                "role_id": role_id,
+                "user_id": user_id,
+                "rule": "回覆保持在三句話以內",
+                "sessions_input": "兩人在咖啡廳初次見面",
+            }))
+            self.session_ids.append(session.json()["id"])
+
+        # 讓歷史訊息與 context 組合接近真實對話的大小
+        async def fill(talk_id: int):
+            for i in range(self.args.history_messages // 2):
+                await self._check(await self.client.post("/api/chat/send", json=self._chat_body(talk_id, i)))
+
+        await asyncio.gather(*(fill(talk_id) for talk_id in self.session_ids))
+
+    def _chat_body(self, talk_id: int, i: int) -> dict:
+        return {"talk_id": talk_id, "user_message": f"第 {i} 則訊息：今天過得怎麼樣？",
+                "model_api_id": self.model_api_id, **CHAT_PARAMS}
+
+    # 各情境的單次操作，worker 編號決定使用的對話
+    async def send(self, worker: int, i: int):
+        await self._check(await self.client.post("/api/chat/send", json=self._chat_body(self.session_ids[worker], i)))
+
+    async def stream(self, worker: int, i: int, ttfb: list[float]):
+        started = time.perf_counter()
+        async with self.client.stream("POST", "/api/chat/stream",
+                                      json=self._chat_body(self.session_ids[worker], i)) as response:
+            await self._check(response)
+            first = True
+            async for line in response.aiter_lines():
+                if first and line.startswith("event: delta"):
+                    ttfb.append(time.perf_counter() - started)
+                    first = False
+                if line.startswith("event: error"):
+                    raise RuntimeError("串流回傳錯誤事件")
+
+    async def history(self, worker: int, i: int):
+        await self._check(await self.client.get(f"/api/chat/{self.session_ids[worker]}/history"))
+
+    async def roles(self, worker: int, i: int):
+        await self._check(await self.client.get("/api/roles/list"))
+
+    async def auth(self, worker: int, i: int):
+        login = await self._check(await self.client.post(
+            "/auth/login", json={"username": BENCH_USER, "password": BENCH_PASSWORD}
+        ))
+        token = login.json()["access_token"]
+        await self._check(await self.client.get("/auth/me", headers={"Authorization": f"Bearer {token}"}))
+
+    async def run(self, operation, requests: int) -> Result:
+        """
+        concurrency 個 worker 共同消化 requests 次操作
+        """
+        result = Result()
+        counter = iter(range(requests))
+
+        async def worker(n: int):
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    await operation(n, i)
+                except Exception as e:
+                    result.errors += 1
+                    if result.errors == 1:
+                        print(f"  第一個錯誤：{e}")
+                else:
+                    result.latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(self.args.concurrency)))
+        result.elapsed = time.perf_counter() - started
+        return result
+
+
+async def run_benchmarks(args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    llm_port, app_port = _free_port(), _free_port()
+    llm_env = {
+        "FAKE_LLM_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LLM_TOKENS_PER_SEC": str(args.tokens_per_sec),
+        "FAKE_LLM_COMPLETION_TOKENS": str(args.completion_tokens),
+    }
+    app_env = {
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(tmpdir, "bench.db"),
+        "DB_PROFILE": "production",
+        "DB_AUTO_MIGRATE": "1",
+        "DB_ECHO": "0",
+    }
+    llm = _start("bench.fake_llm:app", llm_port, llm_env)
+    app = _start("main:app", app_port, app_env, workers=args.workers)
+    try:
+        llm_url = f"http://127.0.0.1:{llm_port}"
+        app_url = f"http://127.0.0.1:{app_port}"
+        await _wait_ready(f"{llm_url}/docs", llm)
+        await _wait_ready(f"{app_url}/docs", app)
+
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=args.timeout) as client:
+            bench = Bench(client, args)
+            print(f"建立測試資料（{args.concurrency} 個對話，各 {args.history_messages} 則歷史訊息）…")
+            await bench.seed(llm_url)
+
+            results = {}
+            for name in args.scenarios:
+                ttfb: list[float] = []
+                operation = getattr(bench, name)
+                if name == "stream":
+                    operation = lambda worker, i, op=operation: op(worker, i, ttfb)
+                if args.warmup:
+                    await bench.run(operation, args.warmup)
+                    ttfb.clear()
+                print(f"執行 {name}（{args.requests} 次，併發 {args.concurrency}）…")
+                result = await bench.run(operation, args.requests)
+                results[name] = result.summary()
+                if name == "stream":
+                    results["stream_ttfb"] = Result(latencies=ttfb).summary()
+            return results
+    finally:
+        for process in (app, llm):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def _config(args) -> dict:
+    return {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "workers": args.workers,
+        "history_messages": args.history_messages,
+        "latency_ms": args.latency_ms,
+        "tokens_per_sec": args.tokens_per_sec,
+        "completion_tokens": args.completion_tokens,
+    }
+
+
+def print_report(results: dict, baseline: dict | None):
+    base = (baseline or {}).get("results", {})
+    print()
+    print(f"{'scenario':<12}{'reqs':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}  vs baseline (p95 / req/s)")
+    for name, r in results.items():
+        line = (f"{name:<12}{r['requests']:>7}{r['errors']:>5}{_fmt(r['p50_ms']):>10}"
+                f"{_fmt(r['p95_ms']):>10}{_fmt(r['p99_ms']):>10}{_fmt(r['rps']):>9}")
+        if name in base:
+            line += f"  {_delta(r['p95_ms'], base[name]['p95_ms'])} / {_delta(r['rps'], base[name]['rps'])}"
+        print(line)
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _delta(value, reference) -> str:
+    if not value or not reference:
+        return "-"
+    return f"{(value - reference) / reference:+.1%}"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    p95 變慢或吞吐量下降超過 tolerance、或出現錯誤時視為退步
+    """
+    regressions = []
+    for name, r in results.items():
+        if r["errors"]:
+            regressions.append(f"{name}: {r['errors']} 個請求失敗")
+        b = baseline["results"].get(name)
+        if not b:
+            continue
+        if r["p95_ms"] and b["p95_ms"] and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {b['p95_ms']} -> {r['p95_ms']} ms")
+        # stream_ttfb 的吞吐量沒有意義
+        if name != "stream_ttfb" and r["rps"] and b["rps"] and r["rps"] < b["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: 吞吐量 {b['rps']} -> {r['rps']} req/s")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以假模型服務壓測聊天、歷史訊息、角色列表與登入")
+    parser.add_argument("-c", "--concurrency", type=int, default=20, help="同時進行的請求數")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每個情境的請求數")
+    parser.add_argument("--warmup", type=int, default=20, help="每個情境正式量測前的暖機請求數")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda s: [x for x in s.split(",") if x],
+                        help=f"要執行的情境（逗號分隔）：{','.join(SCENARIOS)}")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker 數")
+    parser.add_argument("--history-messages", type=int, default=20, help="每個對話預先建立的歷史訊息數")
+    parser.add_argument("--latency-ms", type=float, default=300, help="假模型的首字延遲")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="假模型的 token 產生速度（0 為不限速）")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="假模型每次回覆的 token 數")
+    parser.add_argument("--timeout", type=float, default=120, help="單一請求逾時秒數")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準檔路徑")
+    parser.add_argument("--save-baseline", action="store_true", help="把這次結果存為基準")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="可容許的退步比例")
+    parser.add_argument("--output", help="另外把結果寫成 JSON 檔")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的情境：{','.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmarks(args))
+    report = {
+        "config": _config(args),
+        "environment": {"python": platform.python_version(), "machine": platform.machine(),
+                        "cpus": os.cpu_count(), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        "results": results,
+    }
+
+    baseline = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n已儲存基準：{args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"\n沒有基準檔（{args.baseline}），以 --save-baseline 建立")
+        return 0
+    if baseline.get("config") != report["config"]:
+        print("\n⚠️ 測試參數與基準不同，比較結果僅供參考")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\n效能退步：")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print("\n沒有超過容許範圍的退步")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,134 @@
 from sqlalchemy import create_engine, text
-from sqlalchemy.engine import URL
+from sqlalchemy.engine import URL, make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+import asyncio
+import logging
 import os
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# DB_BACKEND=sqlite 時改用本機 SQLite 檔案（本地開發用）
+DB_BACKEND = os.getenv("DB_BACKEND", "mysql")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "local.db")
+# 唯讀副本：MySQL 設定 DATABASE_READ_URL；SQLite 設定 SQLITE_READ_PATH（本地模擬，定期從主資料庫複製）
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+SQLITE_READ_PATH = os.getenv("SQLITE_READ_PATH")
+SQLITE_REPLICA_SYNC_SECONDS = float(os.getenv("SQLITE_REPLICA_SYNC_SECONDS", 2))
+
+# 連線池設定檔：DB_PROFILE 選擇預設值，個別參數可再用環境變數覆寫
+ENGINE_PROFILES = {
+    "development": {"echo": True, "pool_size": 5, "max_overflow": 5, "pool_recycle": 1800, "pool_timeout": 30},
+    "production": {"echo": False, "pool_size": 10, "max_overflow": 20, "pool_recycle": 1800, "pool_timeout": 30},
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "development" if DB_BACKEND == "sqlite" else "production")
+
+
+def _engine_options() -> dict:
+    options = dict(ENGINE_PROFILES[DB_PROFILE])
+    for key, cast in (("pool_size", int), ("max_overflow", int), ("pool_recycle", int), ("pool_timeout", float)):
+        value = os.getenv(f"DB_{key.upper()}")
+        if value is not None:
+            options[key] = cast(value)
+    if os.getenv("DB_ECHO") is not None:
+        options["echo"] = os.getenv("DB_ECHO") == "1"
+    return options
+
+
+def _create_engines(url, async_url, **kwargs):
+    options = {**_engine_options(), **kwargs}
+    if url.get_backend_name() == "sqlite":
+        sync_engine = create_engine(url, connect_args={"check_same_thread": False}, **options)
+    else:
+        sync_engine = create_engine(url, pool_pre_ping=True, **options)
+        options["pool_pre_ping"] = True
+    return sync_engine, create_async_engine(async_url, **options)
+
+
+if DB_BACKEND == "sqlite":
+    url = make_url(f"sqlite:///{SQLITE_PATH}")
+    async_url = url.set(drivername="sqlite+aiosqlite")
+    read_url = make_url(f"sqlite:///{SQLITE_READ_PATH}") if SQLITE_READ_PATH else None
+else:
+    url = make_url(os.getenv("DATABASE_URL")) if os.getenv("DATABASE_URL") else URL.create(
+        drivername="mysql+mysqlconnector",
+        username="User",
+        password="User%1234",
+        host="tpe1.clusters.zeabur.com",
+        port=21004,
+        database="my_chat_app",
+        query={"charset": "utf8mb4"},
+    )
+    # 非同步連線使用 aiomysql，其餘設定與同步連線相同
+    async_url = url.set(drivername="mysql+aiomysql")
+    read_url = make_url(DATABASE_READ_URL) if DATABASE_READ_URL else None
+
+engine, async_engine = _create_engines(url, async_url)
+if read_url is not None:
+    read_engine, async_read_engine = _create_engines(
+        read_url, read_url.set(drivername="sqlite+aiosqlite" if DB_BACKEND == "sqlite" else "mysql+aiomysql")
+    )
+else:
+    # 沒有設定副本時，讀取也走主資料庫
+    read_engine, async_read_engine = engine, async_engine
 
-url = URL.create(
-    drivername="mysql+mysqlconnector",
-    username="User",
-    password="User%1234",  
-    host="tpe1.clusters.zeabur.com",
-    port=21004,
-    database="my_chat_app",  
-    query={"charset": "utf8mb4"},
-)
-
-# 建立連線字串
-engine = create_engine(url, echo=True, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False：commit 後仍可直接讀取欄位，不會在 async 環境觸發延遲載入
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+# 唯讀 Session：歷史訊息、列表、角色目錄等查詢使用，資料可能稍微落後主資料庫
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = async_sessionmaker(bind=async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-# 🚀 建立資料表
+# 資料表結構由 Alembic 管理（migrations/），部署時先執行 alembic upgrade head
+# DB_AUTO_MIGRATE=1 時由應用啟動自動升級（SQLite 本地開發預設開啟）
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1" if DB_BACKEND == "sqlite" else "0") == "1"
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+
+
+def _alembic_config():
+    from alembic.config import Config
+    config = Config(ALEMBIC_INI)
+    # 沿用應用程式的 logging 設定
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def schema_status() -> tuple[set, set]:
+    """
+    回傳 (資料庫目前版本, migrations 最新版本)
+    """
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    heads = set(ScriptDirectory.from_config(_alembic_config()).get_heads())
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    return current, heads
+
+
+def check_schema(status: tuple[set, set] | None = None):
+    """
+    資料庫版本落後 migrations 時中止啟動，避免以舊結構執行新程式
+    """
+    current, heads = status or schema_status()
+    if current != heads:
+        raise RuntimeError(
+            f"資料庫結構版本 {sorted(current) or '（未建立）'} 與程式需要的 {sorted(heads)} 不符，"
+            f"請先執行 alembic upgrade head"
+        )
+
+
+# 🚀 初始化資料表：版本已是最新時只做一次版本查詢，不載入 Alembic 的 migration 環境
 def init_db():
-    from models import Base  
-    Base.metadata.create_all(bind=engine)
+    status = schema_status()
+    if status[0] != status[1] and DB_AUTO_MIGRATE:
+        from alembic import command
+        command.upgrade(_alembic_config(), "head")
+        status = None
+    check_schema(status)
+    if DB_BACKEND == "sqlite" and SQLITE_READ_PATH:
+        _copy_sqlite(SQLITE_PATH, SQLITE_READ_PATH)
 
 # 取得 DB Session
 def get_db():
@@ -30,3 +137,44 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 取得非同步 DB Session（供 async 路由使用）
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# 取得唯讀 DB Session（未設定副本時與 get_db 相同）
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+def _copy_sqlite(source_path: str, target_path: str):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+async def sync_sqlite_replica():
+    """
+    本地模擬唯讀副本：定期把主資料庫複製到 SQLITE_READ_PATH（間隔即模擬的複寫延遲）
+    """
+    if DB_BACKEND != "sqlite" or not SQLITE_READ_PATH:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(_copy_sqlite, SQLITE_PATH, SQLITE_READ_PATH)
+        except Exception as e:
+            logger.warning("同步 SQLite 副本失敗：%s", e)
+        await asyncio.sleep(SQLITE_REPLICA_SYNC_SECONDS)
@@ -1,23 +1,28 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from database import init_db
-from models import Base
-from database import engine
+from database import init_db, sync_sqlite_replica, engine, async_engine, read_engine, async_read_engine
+from utils.llm_clients import close_all_clients
+from utils.memory_jobs import start_workers, stop_workers
+from utils.images import UPLOAD_DIR, shutdown_pool
+from utils.static import ImageFiles
+from utils.metrics import MetricsMiddleware, register_engine, metrics_response
+from utils.sql_profiler import SQLProfilerMiddleware
+from utils.log import RequestIDMiddleware, setup_logging, shutdown_logging
+from utils.warmup import WARMUP, warm_up
+import asyncio
 import os
 import uvicorn
 import logging
 
-# 建立 logger
+# 結構化 JSON 日誌，經由佇列在背景執行緒輸出到 console（適合 Railway）
+setup_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-handler = logging.StreamHandler()  # 改為印到 console，適合 Railway
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 # 建立 FastAPI app
 app = FastAPI()
+# 預熱完成前 /readyz 回 503
+app.state.ready = False
 
 # CORS 設定（允許所有前端來源）
 app.add_middleware(
@@ -26,36 +31,85 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 列表 API 的下一頁游標與快取版本；除錯模式的 SQL 統計；請求追蹤 ID
+    expose_headers=["X-Next-Cursor", "ETag", "X-DB-Queries", "X-DB-Time", "X-Request-ID"],
 )
 
-# 靜態資源路由（上傳圖檔）
-UPLOAD_DIR = "uploads"
+# Prometheus 指標（/metrics）：路由延遲與每個請求的 DB 查詢；SQL 慢查詢 / N+1 分析
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(SQLProfilerMiddleware)
+# 最外層：之後所有 middleware、路由與背景工作的日誌都帶同一個 request_id
+app.add_middleware(RequestIDMiddleware)
+register_engine("primary", engine)
+register_engine("primary_async", async_engine.sync_engine)
+if read_engine is not engine:
+    register_engine("read", read_engine)
+    register_engine("read_async", async_read_engine.sync_engine)
+
+# 靜態資源路由（上傳圖檔，雜湊檔名可長期快取）
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-
-# 資料庫建表
-Base.metadata.create_all(bind=engine)
+app.mount("/uploads", ImageFiles(directory=UPLOAD_DIR), name="uploads")
 
-# app 啟動時會執行 DB 初始化
+# app 啟動時檢查資料庫結構版本（DB_AUTO_MIGRATE=1 時先自動升級）
 @app.on_event("startup")
 def startup_event():
-    logger.info("🚀 應用啟動中，初始化資料庫")
+    logger.info("🚀 應用啟動中，檢查資料庫結構")
     init_db()
 
+# 啟動自動記憶的背景 worker，並恢復未完成的工作；本地 SQLite 副本另有同步工作
+@app.on_event("startup")
+async def start_background_jobs():
+    await start_workers()
+    app.state.replica_sync = asyncio.create_task(sync_sqlite_replica())
+    app.state.warmup = asyncio.create_task(_warm_up())
+
+# 背景預熱（SDK、tiktoken、模型 client、連線池），完成後才回報 ready
+async def _warm_up():
+    if WARMUP:
+        await warm_up()
+    app.state.ready = True
+
+# app 關閉時停止背景 worker、釋放模型 client 的連線池與圖片處理程序
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.ready = False
+    app.state.warmup.cancel()
+    app.state.replica_sync.cancel()
+    await stop_workers()
+    await close_all_clients()
+    shutdown_pool()
+    shutdown_logging()
+
 # 測試首頁（可用於健康檢查）
 @app.get("/")
 def ping():
     logger.info("✅ ping 成功，後端正常運作中")
     return {"status": "ok"}
 
+# 存活檢查：程序能回應即可，不檢查相依服務（失敗時平台會重啟容器）
+@app.get("/healthz", include_in_schema=False)
+def liveness():
+    return {"status": "alive"}
+
+# 就緒檢查：資料庫結構已確認且預熱完成才接受流量
+@app.get("/readyz", include_in_schema=False)
+def readiness():
+    if not app.state.ready:
+        return JSONResponse({"status": "warming_up"}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
 @app.get("/api/ping")
 def api_ping():
     logger.info("✅ /api/ping 成功被呼叫")
     return {"status": "api is alive"}
 
 # 載入 router 模組
-from router import auth, chat, roles, memories, events, sessions, model_api
+from router import auth, chat, roles, memories, events, sessions, model_api, memory_jobs, usage
 app.include_router(auth.router)
 app.include_router(roles.router)
 app.include_router(chat.router)
@@ -63,6 +117,8 @@ app.include_router(memories.router)
 app.include_router(events.router)
 app.include_router(sessions.router)
 app.include_router(model_api.router)
+app.include_router(memory_jobs.router)
+app.include_router(usage.router)
 
 # 支援 python main.py 啟動（本地測試）
 if __name__ == "__main__":
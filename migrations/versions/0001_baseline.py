@@ -0,0 +1,130 @@
+"""baseline schema (tables previously created by Base.metadata.create_all)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00
+
+既有資料庫已由 create_all 建立這些資料表，因此只建立缺少的資料表，可直接 upgrade。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True),
+            sa.Column("username", sa.String(50), unique=True, nullable=False),
+            sa.Column("password", sa.String(255), nullable=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    if "roles" not in existing:
+        op.create_table(
+            "roles",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("name", sa.String(100), nullable=False),
+            sa.Column("age", sa.Integer(), nullable=True),
+            sa.Column("occupation", sa.String(255), nullable=True),
+            sa.Column("description", sa.Text(), nullable=True),
+            sa.Column("personality", sa.Text(), nullable=True),
+            sa.Column("speaking_style", sa.Text(), nullable=True),
+            sa.Column("hobbies", sa.Text(), nullable=True),
+            sa.Column("worldview", sa.Text(), nullable=True),
+            sa.Column("category", sa.String(100), nullable=True),
+            sa.Column("image", sa.String(255), nullable=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+        )
+    if "chat_sessions" not in existing:
+        op.create_table(
+            "chat_sessions",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True),
+            sa.Column("role_id", sa.Integer(), sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("rule", sa.Text()),
+            sa.Column("is_active", sa.Boolean(), default=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("user_id", sa.Integer()),
+            sa.Column("sessions_input", sa.Text()),
+            sa.Column("title", sa.String(255), nullable=True),
+        )
+    if "chat_messages" not in existing:
+        op.create_table(
+            "chat_messages",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column("talk_id", sa.Integer(), sa.ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("sender", sa.Enum("user", "assistant", name="sender_enum"), nullable=False),
+            sa.Column("message", sa.Text(), nullable=False),
+            sa.Column("timestamp", sa.TIMESTAMP(), server_default=sa.func.current_timestamp(), nullable=False),
+            sa.Column("updated_at", sa.TIMESTAMP(), server_default=sa.func.current_timestamp(), nullable=False),
+        )
+    if "chat_memory" not in existing:
+        op.create_table(
+            "chat_memory",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True, autoincrement=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("talk_id", sa.Integer(), sa.ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=True),
+            sa.Column("memory_text", sa.Text(), nullable=False),
+            sa.Column("is_important", sa.Boolean(), default=False),
+            sa.Column("created_at", sa.TIMESTAMP()),
+        )
+    if "memory_memories" not in existing:
+        op.create_table(
+            "memory_memories",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True, autoincrement=True),
+            sa.Column("role_id", sa.Integer(), sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=False),
+            sa.Column("content", sa.Text()),
+            sa.Column("token_count", sa.Integer(), default=0),
+            sa.Column("section", sa.String(100)),
+            sa.Column("selected", sa.Boolean(), default=False),
+            sa.Column("tags", sa.String(255)),
+            sa.Column("is_active", sa.Boolean(), default=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    if "memory_events" not in existing:
+        op.create_table(
+            "memory_events",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True, autoincrement=True),
+            sa.Column("role_id", sa.Integer(), sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id"), nullable=False),
+            sa.Column("title", sa.String(100)),
+            sa.Column("description", sa.Text()),
+            sa.Column("date", sa.String(100)),
+            sa.Column("tags", sa.String(255)),
+            sa.Column("is_active", sa.Boolean(), default=True),
+            sa.Column("selected", sa.Boolean(), default=False),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+    if "model_apis" not in existing:
+        op.create_table(
+            "model_apis",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False),
+            sa.Column("name", sa.String(50), nullable=False),
+            sa.Column("provider", sa.String(50), nullable=False),
+            sa.Column("config", sa.JSON(), nullable=False),
+            sa.Column("is_active", sa.Boolean(), default=True),
+            sa.Column("created_at", sa.TIMESTAMP()),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ("model_apis", "memory_events", "memory_memories", "chat_memory",
+                  "chat_messages", "chat_sessions", "roles", "users"):
+        op.drop_table(table)
@@ -0,0 +1,53 @@
+"""chat_messages.token_count and memory_jobs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:01
+
+create_all 可能已建立 memory_jobs，但不會幫既有的 chat_messages 補欄位，兩者皆先檢查。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+
+    columns = {c["name"] for c in inspector.get_columns("chat_messages")}
+    if "token_count" not in columns:
+        with op.batch_alter_table("chat_messages") as batch:
+            batch.add_column(sa.Column("token_count", sa.Integer(), nullable=True))
+
+    if "memory_jobs" not in inspector.get_table_names():
+        op.create_table(
+            "memory_jobs",
+            sa.Column("id", sa.Integer(), primary_key=True, index=True),
+            sa.Column("session_id", sa.Integer(), sa.ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("role_id", sa.Integer(), sa.ForeignKey("roles.id"), nullable=False),
+            sa.Column("model_api_id", sa.Integer(), sa.ForeignKey("model_apis.id", ondelete="SET NULL"), nullable=True),
+            sa.Column("message_count", sa.Integer(), nullable=False),
+            sa.Column("status", sa.String(20), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False),
+            sa.Column("last_error", sa.Text(), nullable=True),
+            sa.Column("next_run_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("memory_id", sa.Integer(), nullable=True),
+            sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("memory_jobs")
+    with op.batch_alter_table("chat_messages") as batch:
+        batch.drop_column("token_count")
@@ -0,0 +1,48 @@
+"""hot-path indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:02
+
+聊天、記憶、事件、對話列表與金鑰查詢常用欄位的索引，避免全表掃描。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (索引名稱, 資料表, 欄位)
+INDEXES = [
+    ("ix_chat_messages_talk_id_timestamp", "chat_messages", ["talk_id", "timestamp"]),
+    ("ix_chat_messages_talk_id_id", "chat_messages", ["talk_id", "id"]),
+    ("ix_memory_memories_session_id_is_active", "memory_memories", ["session_id", "is_active"]),
+    ("ix_memory_events_session_id", "memory_events", ["session_id"]),
+    ("ix_chat_sessions_user_id", "chat_sessions", ["user_id"]),
+    ("ix_chat_sessions_role_id", "chat_sessions", ["role_id"]),
+    ("ix_roles_user_id", "roles", ["user_id"]),
+    ("ix_model_apis_user_id", "model_apis", ["user_id"]),
+    ("ix_memory_jobs_status", "memory_jobs", ["status"]),
+    ("ix_memory_jobs_session_id", "memory_jobs", ["session_id"]),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        # create_all 可能已依模型建立部分索引
+        if name not in {ix["name"] for ix in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
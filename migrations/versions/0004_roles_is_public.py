@@ -0,0 +1,41 @@
+"""roles.is_public
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:03
+
+/api/roles/public 依此欄位篩選公開角色。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    # 先前版本的程式已查詢 is_public，部分資料庫可能已手動加上欄位或索引
+    has_column = "is_public" in {column["name"] for column in inspector.get_columns("roles")}
+    has_index = any(ix["column_names"] == ["is_public"] for ix in inspector.get_indexes("roles"))
+    if has_column and has_index:
+        return
+    with op.batch_alter_table("roles") as batch:
+        if not has_column:
+            batch.add_column(sa.Column("is_public", sa.Boolean(), nullable=False, server_default=sa.false()))
+        if not has_index:
+            batch.create_index("ix_roles_is_public", ["is_public"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("roles") as batch:
+        batch.drop_index("ix_roles_is_public")
+        batch.drop_column("is_public")
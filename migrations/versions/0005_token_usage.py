@@ -0,0 +1,52 @@
+"""token usage on chat_messages and token_usage_daily
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:04
+
+每則 assistant 訊息記錄模型呼叫的 prompt / completion token，另以每日彙總表累計用量。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("chat_messages") as batch:
+        batch.add_column(sa.Column("prompt_tokens", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("completion_tokens", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("model_api_id", sa.Integer(), nullable=True))
+        batch.create_foreign_key("fk_chat_messages_model_api_id", "model_apis", ["model_api_id"], ["id"], ondelete="SET NULL")
+
+    op.create_table(
+        "token_usage_daily",
+        sa.Column("id", sa.Integer(), primary_key=True, index=True),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("model_api_id", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(20), nullable=False),
+        sa.Column("requests", sa.Integer(), nullable=False),
+        sa.Column("prompt_tokens", sa.BigInteger(), nullable=False),
+        sa.Column("completion_tokens", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("user_id", "day", "model_api_id", "kind", name="uq_token_usage_daily_key"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("token_usage_daily")
+    with op.batch_alter_table("chat_messages") as batch:
+        batch.drop_constraint("fk_chat_messages_model_api_id", type_="foreignkey")
+        batch.drop_column("model_api_id")
+        batch.drop_column("completion_tokens")
+        batch.drop_column("prompt_tokens")
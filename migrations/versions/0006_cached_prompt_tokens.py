@@ -0,0 +1,31 @@
+"""token_usage_daily.cached_prompt_tokens
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:05
+
+記錄 prompt 中命中供應商 prompt cache 的 token 數，用來計算命中率。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("token_usage_daily") as batch:
+        batch.add_column(sa.Column("cached_prompt_tokens", sa.BigInteger(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("token_usage_daily") as batch:
+        batch.drop_column("cached_prompt_tokens")
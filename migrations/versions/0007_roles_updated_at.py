@@ -0,0 +1,36 @@
+"""roles.updated_at
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 00:00:06
+
+角色設定的版本：聊天 Prompt 的角色區塊依 (role_id, updated_at) 快取。
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite 的 ADD COLUMN 不接受 CURRENT_TIMESTAMP 預設值，先新增欄位、補上現有資料，再設定預設值
+    with op.batch_alter_table("roles") as batch:
+        batch.add_column(sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True))
+    op.execute(sa.text("UPDATE roles SET updated_at = CURRENT_TIMESTAMP"))
+    with op.batch_alter_table("roles") as batch:
+        batch.alter_column("updated_at", existing_type=sa.DateTime(timezone=True), existing_nullable=True,
+                           server_default=sa.text("CURRENT_TIMESTAMP"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("roles") as batch:
+        batch.drop_column("updated_at")
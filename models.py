@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, TIMESTAMP,ForeignKey, Enum, Boolean, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Text, Date, DateTime, TIMESTAMP,ForeignKey, Enum, Boolean, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, false
 from database import Base
 from datetime import datetime
 from sqlalchemy.orm import sessionmaker
-from datetime import datetime
+from datetime import datetime, timezone
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
 
 
 class Role(Base):
@@ -21,8 +25,10 @@ class Role(Base):
     worldview = Column(Text, nullable=True)
     category = Column(String(100), nullable=True)
     image = Column(String(255), nullable=True)  # 新增圖片欄位
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False) 
-    
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    is_public = Column(Boolean, nullable=False, default=False, server_default=false(), index=True)  # 是否出現在公開角色列表
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())  # 角色設定快取的版本
+
 
 
 
@@ -77,12 +83,24 @@ class ChatMessage(Base):
     talk_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
     sender = Column(Enum("user", "assistant", name="sender_enum"), nullable=False)
     message = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=True)  # 寫入時計算，組 Prompt 時不必重新編碼
+    # 產生這則回覆的模型呼叫用量（僅 assistant 訊息），可找出 Prompt 過度成長的對話
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+    model_api_id = Column(Integer, ForeignKey("model_apis.id", ondelete="SET NULL"), nullable=True)
     timestamp = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=False)
     updated_at = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), nullable=False)
 
     # 建立與 `chat_sessions` 的關聯
     talk = relationship("ChatSession", back_populates="messages")
 
+    __table_args__ = (
+        # 歷史訊息游標分頁：WHERE talk_id = ? AND id < ? ORDER BY id DESC
+        Index("ix_chat_messages_talk_id_id", "talk_id", "id"),
+        # 組 Prompt / 摘要取最近訊息：ORDER BY timestamp DESC
+        Index("ix_chat_messages_talk_id_timestamp", "talk_id", "timestamp"),
+    )
+
 
 
 class Memory(Base):
@@ -100,12 +118,17 @@ class Memory(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (
+        # 組 Prompt 時載入對話的啟用記憶
+        Index("ix_memory_memories_session_id_is_active", "session_id", "is_active"),
+    )
+
 class Event(Base):
     __tablename__ = "memory_events"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     role_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=False, index=True)
     title = Column(String(100))
     description = Column(Text)
     date = Column(String(100))
@@ -119,12 +142,12 @@ class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
     id = Column(Integer, primary_key=True, index=True)
-    role_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    role_id = Column(Integer, ForeignKey("roles.id"), nullable=False, index=True)
     rule = Column(Text)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
-    user_id = Column(Integer)
+    user_id = Column(Integer, index=True)
     sessions_input = Column(Text)
     messages = relationship("ChatMessage", back_populates="talk", cascade="all, delete-orphan")
     memories = relationship("ChatMemory", back_populates="session")
@@ -136,15 +159,58 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, nullable=False)
     password = Column(String(255), nullable=False)
+    # 寫入 Token 的版本，只在變更密碼時遞增（登入時重新雜湊不影響已發出的 Token）
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     model_apis = relationship("ModelAPI", back_populates="user", cascade="all, delete")
 
 
+class MemoryJob(Base):
+    __tablename__ = "memory_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    role_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    model_api_id = Column(Integer, ForeignKey("model_apis.id", ondelete="SET NULL"), nullable=True)
+    message_count = Column(Integer, nullable=False, default=5)   # 摘要涵蓋的訊息數
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending / running / succeeded / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_run_at = Column(DateTime(timezone=True), nullable=True)
+    memory_id = Column(Integer, nullable=True)                    # 成功後產生的記憶
+    # 佇列比較的時間（next_run_at、逾時恢復的 updated_at）一律由應用程式寫入 UTC，不混用資料庫時鐘（時區可能不是 UTC）
+    created_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), default=_utcnow, onupdate=_utcnow, server_default=func.now())
+
+
+class TokenUsageDaily(Base):
+    """
+    每日 token 用量彙總（依金鑰擁有者 / 金鑰 / 用途），每次模型呼叫後以 upsert 累加
+    報表只查這張表，不掃描 chat_messages
+    """
+    __tablename__ = "token_usage_daily"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False)                             # UTC 日期
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    model_api_id = Column(Integer, nullable=False)                # 不設外鍵：金鑰刪除後仍保留用量紀錄
+    kind = Column(String(20), nullable=False)                     # chat / memory
+    requests = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(BigInteger, nullable=False, default=0)
+    completion_tokens = Column(BigInteger, nullable=False, default=0)
+    cached_prompt_tokens = Column(BigInteger, nullable=False, default=0, server_default="0")  # 命中供應商 prompt cache 的部分
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "model_api_id", "kind", name="uq_token_usage_daily_key"),
+    )
+
+
 class ModelAPI(Base):
     __tablename__ = "model_apis"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     name = Column(String(50), nullable=False)            # 顯示名稱（自訂）
     provider = Column(String(50), nullable=False)         # 模型平台，例如 azure、gemini
     config = Column(JSON, nullable=False)                 # 儲存參數 JSON
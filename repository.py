@@ -1,11 +1,43 @@
+from datetime import date
+from sqlalchemy import select, union_all, literal, null, func
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import models, schemas
 from router import auth
+from utils.llm_clients import evict_client
+from utils.auth import invalidate_user
+from utils.context import CONTEXT_HISTORY_LIMIT, count_tokens
+from utils import context_cache
+from utils.context_cache import ChatContext, SessionContext, CachedMessage, CachedMemory, CachedModelAPI, CompiledPersona
+from utils.pagination import apply_filters, after_cursor
 
 # 查詢所有角色
 def get_roles(db: Session):
     return db.query(models.Role).all()
 
+# 角色卡片欄位：列表只需要這些，不載入 personality / worldview 等長文字，也不產生 ORM 物件
+ROLE_CARD_COLUMNS = (
+    models.Role.id, models.Role.name, models.Role.age, models.Role.occupation, models.Role.description,
+    models.Role.category, models.Role.image, models.Role.user_id, models.Role.is_public,
+)
+
+# 角色卡片列表查詢（分頁 / 匯出共用）
+def role_cards_query(cursor: int | None = None, **filters):
+    stmt = apply_filters(select(*ROLE_CARD_COLUMNS), models.Role, **filters)
+    return after_cursor(stmt, models.Role.id, cursor)
+
+# 使用者聊過的角色卡片（子查詢，不必先載入所有對話）
+def chatting_role_cards_query(user_id: int):
+    role_ids = select(models.ChatSession.role_id).filter(models.ChatSession.user_id == user_id)
+    return select(*ROLE_CARD_COLUMNS).filter(models.Role.id.in_(role_ids)).order_by(models.Role.id)
+
+# 角色卡片查詢結果的版本：筆數、id 總和（增刪）與最後更新時間（編輯），只回傳一列彙總，不讀取卡片內容
+def role_cards_version(db: Session, stmt) -> tuple:
+    cards = stmt.add_columns(models.Role.updated_at).subquery()
+    return tuple(db.execute(
+        select(func.count(), func.sum(cards.c.id), func.max(cards.c.updated_at))
+    ).one())
+
 # 查詢我的角色
 def get_roles_by_user(db: Session, user_id: int):
     return db.query(models.Role).filter(models.Role.user_id == user_id).all()
@@ -33,6 +65,7 @@ def update_role(db: Session, role_id: int, role_update: schemas.RoleCreate):
         setattr(role, key, value)  # 動態更新屬性
 
     db.commit()
+    context_cache.invalidate_role(role_id)
     db.refresh(role)
     return role  # 回傳更新後的角色
 
@@ -43,6 +76,7 @@ def delete_role(db: Session, role_id: int):
         return None
     db.delete(role)
     db.commit()
+    context_cache.invalidate_role(role_id)
     return role
 from fastapi import HTTPException
 
@@ -54,113 +88,234 @@ def get_role_or_404(db: Session, role_id: int):
     return role
 
 
-# 取得所有記憶（可擴充條件過濾）
-def get_memories(db: Session):
-    return db.query(models.Memory).all()
+def _by_user(stmt, model, user_id: int | None):
+    # 記憶 / 事件沒有 user_id，透過所屬對話過濾
+    if user_id is not None:
+        stmt = stmt.join(models.ChatSession, models.ChatSession.id == model.session_id).filter(models.ChatSession.user_id == user_id)
+    return stmt
+
+# 記憶列表查詢（分頁 / 匯出共用）
+def memories_query(cursor: int | None = None, user_id: int | None = None, **filters):
+    stmt = apply_filters(_by_user(select(models.Memory), models.Memory, user_id), models.Memory, **filters)
+    return after_cursor(stmt, models.Memory.id, cursor)
+
+# 取得記憶（游標分頁，可依 user_id / role_id / session_id / is_active / selected 過濾）
+async def get_memories(db: AsyncSession, limit: int, cursor: int | None = None, **filters):
+    result = await db.execute(memories_query(cursor, **filters).limit(limit + 1))
+    return result.scalars().all()
 
 # 取得單筆
-def get_memory_by_id(db: Session, memory_id: int):
-    return db.query(models.Memory).filter(models.Memory.id == memory_id).first()
+async def get_memory_by_id(db: AsyncSession, memory_id: int):
+    return await db.get(models.Memory, memory_id)
 
 # 建立
-def create_memory(db: Session, memory: schemas.MemoryCreate):
+async def create_memory(db: AsyncSession, memory: schemas.MemoryCreate):
     db_memory = models.Memory(**memory.dict())
+    db_memory.token_count = count_tokens(db_memory.content)
     db.add(db_memory)
-    db.commit()
-    db.refresh(db_memory)
+    await db.commit()
+    await db.refresh(db_memory)
+    context_cache.invalidate_session(db_memory.session_id)
     return db_memory
 
 # 更新
-def update_memory(db: Session, memory_id: int, memory: schemas.MemoryUpdate):
-    db_memory = db.query(models.Memory).filter(models.Memory.id == memory_id).first()
+async def update_memory(db: AsyncSession, memory_id: int, memory: schemas.MemoryUpdate):
+    db_memory = await db.get(models.Memory, memory_id)
     if db_memory:
+        old_session_id = db_memory.session_id
         for key, value in memory.dict(exclude_unset=True).items():
             setattr(db_memory, key, value)
-        db.commit()
-        db.refresh(db_memory)
+        db_memory.token_count = count_tokens(db_memory.content)
+        await db.commit()
+        await db.refresh(db_memory)
+        context_cache.invalidate_session(old_session_id, db_memory.session_id)
     return db_memory
 
 # 刪除
-def delete_memory(db: Session, memory_id: int):
-    db_memory = db.query(models.Memory).filter(models.Memory.id == memory_id).first()
+async def delete_memory(db: AsyncSession, memory_id: int):
+    db_memory = await db.get(models.Memory, memory_id)
     if db_memory:
-        db.delete(db_memory)
-        db.commit()
+        await db.delete(db_memory)
+        await db.commit()
+        context_cache.invalidate_session(db_memory.session_id)
     return db_memory
 
 
-# 取得所有事件
-def get_events(db: Session):
-    return db.query(models.Event).all()
+# 事件列表查詢（分頁 / 匯出共用）
+def events_query(cursor: int | None = None, user_id: int | None = None, **filters):
+    stmt = apply_filters(_by_user(select(models.Event), models.Event, user_id), models.Event, **filters)
+    return after_cursor(stmt, models.Event.id, cursor)
+
+# 取得事件（游標分頁，可依 user_id / role_id / session_id / is_active / selected 過濾）
+async def get_events(db: AsyncSession, limit: int, cursor: int | None = None, **filters):
+    result = await db.execute(events_query(cursor, **filters).limit(limit + 1))
+    return result.scalars().all()
+
+# 每日 token 用量（只查彙總表），新到舊
+async def get_daily_usage(db: AsyncSession, user_id: int, start: date, end: date, **filters):
+    T = models.TokenUsageDaily
+    stmt = apply_filters(select(T).filter(T.user_id == user_id, T.day >= start, T.day <= end), T, **filters)
+    result = await db.execute(stmt.order_by(T.day.desc(), T.model_api_id, T.kind))
+    return result.scalars().all()
 
 # 取得單筆事件
-def get_event_by_id(db: Session, event_id: int):
-    return db.query(models.Event).filter(models.Event.id == event_id).first()
+async def get_event_by_id(db: AsyncSession, event_id: int):
+    return await db.get(models.Event, event_id)
 
 # 新增事件
-def create_event(db: Session, event: schemas.EventCreate):
+async def create_event(db: AsyncSession, event: schemas.EventCreate):
     db_event = models.Event(**event.dict())
     db.add(db_event)
-    db.commit()
-    db.refresh(db_event)
+    await db.commit()
+    await db.refresh(db_event)
     return db_event
 
 # 更新事件
-def update_event(db: Session, event_id: int, event: schemas.EventUpdate):
-    db_event = db.query(models.Event).filter(models.Event.id == event_id).first()
+async def update_event(db: AsyncSession, event_id: int, event: schemas.EventUpdate):
+    db_event = await db.get(models.Event, event_id)
     if db_event:
         for key, value in event.dict(exclude_unset=True).items():
             setattr(db_event, key, value)
-        db.commit()
-        db.refresh(db_event)
+        await db.commit()
+        await db.refresh(db_event)
     return db_event
 
 # 刪除事件
-def delete_event(db: Session, event_id: int):
-    db_event = db.query(models.Event).filter(models.Event.id == event_id).first()
+async def delete_event(db: AsyncSession, event_id: int):
+    db_event = await db.get(models.Event, event_id)
     if db_event:
-        db.delete(db_event)
-        db.commit()
+        await db.delete(db_event)
+        await db.commit()
     return db_event
 
 
-def get_sessions(db: Session):
-    return db.query(models.ChatSession).all()
+# 對話列表查詢（分頁 / 匯出共用）
+def sessions_query(cursor: int | None = None, **filters):
+    stmt = apply_filters(select(models.ChatSession), models.ChatSession, **filters)
+    return after_cursor(stmt, models.ChatSession.id, cursor)
+
+# 取得對話（游標分頁，可依 user_id / role_id / is_active 過濾）
+async def get_sessions(db: AsyncSession, limit: int, cursor: int | None = None, **filters):
+    result = await db.execute(sessions_query(cursor, **filters).limit(limit + 1))
+    return result.scalars().all()
 
-def get_session_by_id(db: Session, session_id: int):
-    return db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
+async def get_session_by_id(db: AsyncSession, session_id: int):
+    return await db.get(models.ChatSession, session_id)
 
-def create_session(db: Session, session: schemas.ChatSessionCreate):
+async def create_session(db: AsyncSession, session: schemas.ChatSessionCreate):
     db_session = models.ChatSession(**session.dict())
     db.add(db_session)
-    db.commit()
-    db.refresh(db_session)
+    await db.commit()
+    await db.refresh(db_session)
     return db_session
 
-def update_session(db: Session, session_id: int, session: schemas.ChatSessionUpdate):
-    db_session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
+async def update_session(db: AsyncSession, session_id: int, session: schemas.ChatSessionUpdate):
+    db_session = await db.get(models.ChatSession, session_id)
     if db_session:
         for key, value in session.dict(exclude_unset=True).items():
             setattr(db_session, key, value)
-        db.commit()
-        db.refresh(db_session)
+        await db.commit()
+        await db.refresh(db_session)
+        context_cache.invalidate_session(session_id)
     return db_session
 
-def delete_session(db: Session, session_id: int):
-    db_session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
+async def delete_session(db: AsyncSession, session_id: int):
+    db_session = await db.get(models.ChatSession, session_id)
     if db_session:
-        db.delete(db_session)
-        db.commit()
+        # AsyncSession.delete 會在 greenlet 中載入 messages 以執行 cascade 刪除
+        await db.delete(db_session)
+        await db.commit()
+        context_cache.invalidate_session(session_id)
     return db_session
 
 # repository.py
-# 聊天頁取得角色資訊
-def get_role_by_session(db: Session, session_id: int):
-    session = db.query(models.ChatSession).filter(models.ChatSession.id == session_id).first()
-    if not session:
-        return None
-    role = db.query(models.Role).filter(models.Role.id == session.role_id).first()
-    return role
+# 聊天頁取得角色資訊（一次 JOIN 查詢）
+async def get_role_by_session(db: AsyncSession, session_id: int):
+    result = await db.execute(
+        select(models.Role)
+        .join(models.ChatSession, models.ChatSession.role_id == models.Role.id)
+        .where(models.ChatSession.id == session_id)
+    )
+    return result.scalars().first()
+
+# 角色設定區塊需要的欄位（utils.context.render_persona）
+ROLE_PERSONA_COLUMNS = (
+    models.Role.name, models.Role.age, models.Role.occupation, models.Role.description, models.Role.personality,
+    models.Role.speaking_style, models.Role.hobbies, models.Role.worldview,
+)
+
+# 角色設定快取未命中時（對話快取仍有效）載入單一角色
+async def load_persona(db: AsyncSession, role_id: int, version) -> CompiledPersona:
+    row = (await db.execute(
+        select(models.Role.updated_at, *ROLE_PERSONA_COLUMNS).where(models.Role.id == role_id)
+    )).first()
+    # 版本以資料庫為準：對話快取中的版本可能已過期
+    return context_cache.compile_persona(role_id, row, row.updated_at if row else version)
+
+# 送出訊息前載入聊天所需的全部資料，共兩次查詢：
+# 1. 對話 + 角色 + 模型金鑰（JOIN）
+# 2. 近期訊息 + 啟用中的記憶（UNION ALL）
+# 角色設定依 (role_id, updated_at) 快取，未命中時以第 1 次查詢取得的欄位組合
+async def load_chat_context(db: AsyncSession, session_id: int, model_api_id: int | None = None,
+                            history_limit: int = CONTEXT_HISTORY_LIMIT) -> ChatContext:
+    S, R, M = models.ChatSession, models.Role, models.ModelAPI
+    stmt = (
+        select(S.id, S.role_id, S.rule, S.sessions_input, R.id.label("role_found"), R.updated_at.label("role_version"),
+               *ROLE_PERSONA_COLUMNS)
+        .select_from(S)
+        .outerjoin(R, R.id == S.role_id)
+        .where(S.id == session_id)
+    )
+    if model_api_id:
+        stmt = stmt.add_columns(M.id.label("api_id"), M.provider, M.config, M.user_id.label("api_user_id")) \
+            .outerjoin(M, M.id == model_api_id)
+    row = (await db.execute(stmt)).first()
+
+    model_api = None
+    if model_api_id:
+        if row is None:
+            # 對話不存在時仍需要模型金鑰
+            api = await db.get(M, model_api_id)
+            api_row = (api.id, api.provider, api.config, api.user_id) if api else (None, None, None, None)
+        else:
+            api_row = (row.api_id, row.provider, row.config, row.api_user_id)
+        if api_row[0] is not None:
+            model_api = CachedModelAPI(id=api_row[0], provider=api_row[1], config=api_row[2], user_id=api_row[3])
+    if row is None:
+        return ChatContext(session=None, model_api=model_api)
+
+    if context_cache.get_persona(row.role_id, row.role_version) is None:
+        context_cache.compile_persona(row.role_id, row if row.role_found is not None else None, row.role_version)
+
+    recent = (
+        select(models.ChatMessage.id, models.ChatMessage.sender, models.ChatMessage.message,
+               models.ChatMessage.token_count, models.ChatMessage.timestamp)
+        .where(models.ChatMessage.talk_id == session_id)
+        .order_by(models.ChatMessage.timestamp.desc(), models.ChatMessage.id.desc())
+        .limit(history_limit)
+        .subquery("recent")
+    )
+    rows = (await db.execute(union_all(
+        select(literal("message").label("kind"), recent.c.id, recent.c.sender, recent.c.message.label("content"),
+               recent.c.token_count, literal(False).label("selected"), recent.c.timestamp.label("ts")),
+        select(literal("memory"), models.Memory.id, null(), models.Memory.content,
+               models.Memory.token_count, models.Memory.selected, null())
+        .where(models.Memory.session_id == session_id, models.Memory.is_active == True),
+    ))).all()
+
+    messages = sorted((r for r in rows if r.kind == "message"), key=lambda r: (r.ts, r.id), reverse=True)
+    session = SessionContext(
+        session_id=row[0],
+        role_id=row[1],
+        role_name=row.name,
+        role_version=row.role_version,
+        rule=row[2],
+        sessions_input=row[3],
+        history=tuple(CachedMessage(id=r.id, sender=r.sender, message=r.content, token_count=r.token_count) for r in messages),
+        memories=tuple(CachedMemory(id=r.id, content=r.content, token_count=r.token_count, selected=bool(r.selected))
+                       for r in rows if r.kind == "memory"),
+    )
+    return ChatContext(session=session, model_api=model_api)
 
 
 
@@ -174,6 +329,22 @@ def create_user(db: Session, username: str, password: str):
     db.refresh(user)
     return user
 
+# 變更密碼：Token 版本遞增，已發出的 Token 全部失效
+def update_user_password(db: Session, user: models.User, password: str):
+    user.password = password
+    user.token_version = (user.token_version or 0) + 1
+    db.commit()
+    invalidate_user(user.id)
+    return user
+
+# 雜湊設定變更後重新雜湊（密碼本身不變），不影響已發出的 Token
+# commit 後重新載入，呼叫端（事件迴圈）讀取欄位時不會再觸發同步查詢
+def rehash_user_password(db: Session, user: models.User, password_hash: str):
+    user.password = password_hash
+    db.commit()
+    db.refresh(user)
+    return user
+
 # 新增
 def create_model_api(db, user_id: int, data):
     new_api = models.ModelAPI(
@@ -200,6 +371,8 @@ def update_model_api(db, api_id: int, data):
         setattr(api, key, value)
     db.commit()
     db.refresh(api)
+    evict_client(api_id)  # 設定變更，丟棄快取的模型 client
+    context_cache.invalidate_model_api(api_id)
     return api
 
 # 刪除
@@ -209,4 +382,6 @@ def delete_model_api(db, api_id: int):
         return None
     db.delete(api)
     db.commit()
+    evict_client(api_id)
+    context_cache.invalidate_model_api(api_id)
     return api
\ No newline at end of file
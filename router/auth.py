@@ -1,45 +1,75 @@
 # router/auth.py
 
+import logging
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from database import get_db
 import schemas
 import repository
 from utils.auth import (
-    verify_password,
-    hash_password,
+    hash_password_async,
+    verify_and_update_password,
     create_access_token,
-    get_current_user
+    get_current_user,
+    Principal
 )
 
 from models import User
 
 router = APIRouter(prefix="/auth", tags=["auth"])
+logger = logging.getLogger(__name__)
+
+# 密碼雜湊與驗證在 utils.auth 的專用執行緒池執行，同步的 DB 操作放到執行緒池，避免阻塞事件迴圈
 
 # 🔐 註冊會員
 @router.post("/register")
-def register(user: schemas.UserRegister, db: Session = Depends(get_db)):
-    db_user = repository.get_user_by_username(db, user.username)
+async def register(user: schemas.UserRegister, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(repository.get_user_by_username, db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="使用者名稱已存在")
-    hashed_pw = hash_password(user.password)
-    repository.create_user(db, user.username, hashed_pw)
+    hashed_pw = await hash_password_async(user.password)
+    await run_in_threadpool(repository.create_user, db, user.username, hashed_pw)
     return {"message": "註冊成功"}
 
 # 🔐 登入會員
 @router.post("/login", response_model=schemas.TokenResponse)
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    print("登入帳號：", user.username)
-    db_user = repository.get_user_by_username(db, user.username)
-    if not db_user or not verify_password(user.password, db_user.password):
+async def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
+    db_user = await run_in_threadpool(repository.get_user_by_username, db, user.username)
+    if not db_user:
+        logger.info("登入失敗：帳號不存在", extra={"username": user.username})
+        raise HTTPException(status_code=401, detail="帳號或密碼錯誤")
+    verified, new_hash = await verify_and_update_password(user.password, db_user.password)
+    if not verified:
+        logger.info("登入失敗：密碼錯誤", extra={"user_id": db_user.id})
         raise HTTPException(status_code=401, detail="帳號或密碼錯誤")
-    token = create_access_token(data={"user_id": db_user.id, "username": db_user.username})
-    print("登入帳號：", user.username)
-    print("查到使用者：", db_user.username if db_user else "None")
-    print("密碼是否正確：", verify_password(user.password, db_user.password))
+    if new_hash:
+        # 雜湊設定已變更，以新設定重新雜湊（Token 版本不變，其他裝置不會被登出）
+        # 在執行緒池中 commit 並重新載入，之後讀取 db_user 的欄位不會在事件迴圈中查詢資料庫
+        db_user = await run_in_threadpool(repository.rehash_user_password, db, db_user, new_hash)
+    logger.info("登入成功", extra={"user_id": db_user.id, "rehashed": bool(new_hash)})
+    token = create_access_token(data={
+        "user_id": db_user.id,
+        "username": db_user.username,
+        "ver": db_user.token_version
+    })
     return {"access_token": token, "token_type": "bearer"}
 
 # 🔐 取得當前使用者
 @router.get("/me", response_model=schemas.UserInfo)
-def read_current_user(current_user: User = Depends(get_current_user)):
+def read_current_user(current_user: Principal = Depends(get_current_user)):
     return current_user
+
+# 🔐 變更密碼（舊 Token 隨之失效，需重新登入）
+@router.post("/change-password")
+async def change_password(
+    data: schemas.ChangePasswordRequest,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    db_user = await run_in_threadpool(lambda: db.query(User).filter(User.id == current_user.id).first())
+    if not db_user or not (await verify_and_update_password(data.old_password, db_user.password))[0]:
+        raise HTTPException(status_code=400, detail="舊密碼錯誤")
+    new_hash = await hash_password_async(data.new_password)
+    await run_in_threadpool(repository.update_user_password, db, db_user, new_hash)
+    return {"message": "密碼已更新，請重新登入"}
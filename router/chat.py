@@ -1,145 +1,166 @@
 import openai
 import os
+import json
 import time
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-from database import get_db
-from models import ChatSession, ChatMessage, Memory, ModelAPI
+import asyncio
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, get_async_read_db, AsyncSessionLocal
+from models import ChatSession, ChatMessage, ModelAPI
 from schemas import ChatRequest, ChatResponse,ChatHistoryResponse,UpdateMessageRequest
 from dotenv import load_dotenv
+from dataclasses import replace
 from datetime import datetime
+from typing import Optional
 from schemas import RoleSchema
-from repository import get_role_by_session
+from repository import get_role_by_session, load_chat_context, load_persona
+from utils.llm_clients import AZURE_API_VERSION, get_client
+from utils.memory_jobs import enqueue_memory_job
+from utils.context import assemble_context, context_budget, count_tokens
+from utils import context_cache, gemini
+from utils.context_cache import CachedModelAPI, SessionContext
+from utils.images import image_url
+from utils.metrics import observe_llm, observe_ttft, record_tokens
+from utils.usage import TokenUsage, add_daily_usage, gemini_usage, local_usage, openai_usage
+from utils.sql_profiler import query_budget
+from utils.log import redact
 
 
 # import opencc 
 # converter = opencc.OpenCC('s2t')
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-@router.post("/api/chat/send", response_model=ChatResponse)
-async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
-    """
-    用戶發送訊息，後端處理後回應 AI 內容
-    """
-    # 嘗試獲取 talk_id，若不存在則建立新的對話
-    session = db.query(ChatSession).filter(ChatSession.id == request.talk_id).first()
-    if not session:
-        new_session = ChatSession(user_id=1, role_id=1)  # 預設 user_id 和 role_id
-        db.add(new_session)
-        db.commit()
-        db.refresh(new_session)
-        session = new_session  # 讓 session 變成剛剛建立的對話
-        request.talk_id = new_session.id  # 更新 talk_id，確保後續查詢成功
-
-    # 取得最近 10 條短期記憶
-    recent_messages = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.talk_id == request.talk_id)
-        .order_by(ChatMessage.timestamp.desc())
-        .limit(10)
-        .all()
-    )
+SYSTEM_PROMPT = "請和使用者玩戀愛角色扮演遊戲，請模仿角色性格，參考發生過的事件、回憶，以角色的角度回覆對話，請始終使用繁體中文回應使用者，回應內容必須符合以下對話規則，回覆字數接近500但不超過500。"
 
-    # 整合 Prompt
-    prompt_messages = []
-    
-    # 整合 Prompt 初始化
-    prompt_messages = [{
-        "role": "system",
-        "content": "請和使用者玩戀愛角色扮演遊戲，請模仿角色性格，參考發生過的事件、回憶，以角色的角度回覆對話，請始終使用繁體中文回應使用者，回應內容必須符合以下對話規則，回覆字數接近500但不超過500。"
-    }]
-
-    # 決定使用哪種記憶來源：sessions_input 或 ChatMemory
-    use_session_input = getattr(request, "use_session_input", True)
-
-    if use_session_input:
-        # ✅ 使用 chat_sessions.sessions_input 內容
-        if session.sessions_input:
-            prompt_messages.append({
-                "role": "system",
-                "content": session.sessions_input
-            })
-    else:
-        # 取得長期記憶 (重要記憶)
-        important_memories = (
-            db.query(Memory)
-            .filter(Memory.session_id == session.id, Memory.is_active == True)
-            .all()
-        )
-        # ✅ 改為加入 ChatMemory 記憶（保留原有邏輯）
-        for memory in important_memories:
-            prompt_messages.append({
-                "role": "system",
-                "content": f"重要記憶：{memory.memory_text}"
-            })
-    
-    for msg in reversed(recent_messages):  # 逆序，讓最新對話在最下方
-        prompt_messages.append({"role": msg.sender, "content": msg.message})
+AZURE_STREAM_USAGE_API_VERSION = "2024-09-01-preview"
 
-    # 加入用戶最新的輸入
-    prompt_messages.append({"role": "user", "content": request.user_message})
 
-    model_api = db.query(ModelAPI).filter(ModelAPI.id == request.model_api_id).first()
+def _deployment(model_api) -> str | None:
+    # 指標標籤：Azure 為部署名稱，Gemini 為模型名稱
+    if model_api.provider == "azure":
+        return model_api.config.get("deployment_name")
+    return gemini.model_name(model_api.config).removeprefix("models/")
+
+
+async def prepare_chat(request: ChatRequest, db: AsyncSession):
+    """
+    取得（或建立）對話、組合 Prompt 並檢查模型金鑰，供一般與串流聊天共用
+    """
+    # 先查熱資料快取，未命中才讀資料庫（一次載入對話、角色、金鑰、近期訊息與記憶）
+    ctx = context_cache.get_session_context(request.talk_id)
+    model_api = context_cache.get_model_api(request.model_api_id) if request.model_api_id else None
+    if ctx is None:
+        loaded = await load_chat_context(db, request.talk_id, None if model_api else request.model_api_id)
+        model_api = model_api or loaded.model_api
+        ctx = loaded.session
+        if ctx is None:
+            # 對話不存在則建立新的對話
+            new_session = ChatSession(user_id=1, role_id=1)  # 預設 user_id 和 role_id
+            db.add(new_session)
+            await db.commit()
+            request.talk_id = new_session.id  # 更新 talk_id，確保後續查詢成功
+            ctx = SessionContext(session_id=new_session.id, role_id=new_session.role_id, role_name=None,
+                                 role_version=None, rule=None, sessions_input=None, history=(), memories=())
+        context_cache.put_session_context(ctx)
+    elif request.model_api_id and model_api is None:
+        api = await db.get(ModelAPI, request.model_api_id)
+        if api:
+            model_api = CachedModelAPI(id=api.id, provider=api.provider, config=api.config, user_id=api.user_id)
+    if model_api:
+        context_cache.put_model_api(model_api)
+
     if not model_api:
-        print("模型金鑰不存在")
+        logger.warning("模型金鑰不存在", extra={"model_api_id": request.model_api_id, "talk_id": request.talk_id})
         raise HTTPException(status_code=404, detail="模型金鑰不存在")
 
     provider = model_api.provider
     config = model_api.config
 
-    
     if not provider:
         raise HTTPException(status_code=400, detail="模型 provider 為空")
     if not config:
         raise HTTPException(status_code=400, detail="模型 config 為空")
 
-    print("max_tokens",request.max_tokens)
+    # 角色設定區塊（含 token 數）依角色版本快取，通常在載入對話時已組好
+    persona = context_cache.get_persona(ctx.role_id, ctx.role_version)
+    if persona is None:
+        persona = await load_persona(db, ctx.role_id, ctx.role_version)
+        if persona.version != ctx.role_version:
+            ctx = replace(ctx, role_version=persona.version)
+            context_cache.put_session_context(ctx)
+
+    # 整合 Prompt
+    prompt_messages = assemble_context(
+        system_prompt=SYSTEM_PROMPT,
+        persona=persona.text,
+        persona_tokens=persona.tokens,
+        rule=ctx.rule,
+        sessions_input=ctx.sessions_input,
+        memories=ctx.memories,
+        history=ctx.history,
+        user_message=request.user_message,
+        budget=context_budget(config, request.max_tokens),
+    )
 
-    # 呼叫 Azure OpenAI API (新版)
+    return ctx, prompt_messages, model_api
+
+
+@router.post("/api/chat/send", response_model=ChatResponse, dependencies=[query_budget(6)])
+async def send_message(request: ChatRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    """
+    用戶發送訊息，後端處理後回應 AI 內容
+    """
+    ctx, prompt_messages, model_api = await prepare_chat(request, db)
+    provider = model_api.provider
+    config = model_api.config
+
+    # 呼叫模型 API（client 由 utils.llm_clients 依金鑰快取重用）
     max_retries =1  # 最多重試 3 次
     for attempt in range(max_retries):
         try:
             if provider == "azure":
-                from openai import AzureOpenAI
-                client = AzureOpenAI(
-                    api_key=config["api_key"],
-                    api_version="2023-07-01-preview",
-                    azure_endpoint=config["endpoint"]
-                )
-                print("Azure 請求發送中")
-                response = client.chat.completions.create(
-                    model=config["deployment_name"],
-                    messages=prompt_messages,
-                    temperature=request.temperature,
-                    max_tokens=request.max_tokens,
-                    top_p=request.top_p,
-                    presence_penalty=request.presence_penalty,
-                    frequency_penalty=request.frequency_penalty
-                )
-                print("Azure 回覆成功")
+                client = get_client(model_api)
+                logger.debug("Azure 請求發送中", extra={"talk_id": request.talk_id, "max_tokens": request.max_tokens,
+                                                      "messages": len(prompt_messages)})
+                with observe_llm(provider, _deployment(model_api), "chat"):
+                    response = await client.chat.completions.create(
+                        model=config["deployment_name"],
+                        messages=prompt_messages,
+                        temperature=request.temperature,
+                        max_tokens=request.max_tokens,
+                        top_p=request.top_p,
+                        presence_penalty=request.presence_penalty,
+                        frequency_penalty=request.frequency_penalty
+                    )
                 assistant_message = response.choices[0].message.content
+                usage = openai_usage(response.usage, prompt_messages, assistant_message)
+                logger.debug("Azure 回覆成功", extra={"talk_id": request.talk_id, "prompt_tokens": usage.prompt_tokens,
+                                                    "cached_tokens": usage.cached_tokens,
+                                                    "completion_tokens": usage.completion_tokens})
 
             elif provider == "gemini":
                 try:
-                    import google.generativeai as genai
-                    genai.configure(api_key=config["api_key"])
-
-                    model = genai.GenerativeModel("models/gemini-1.5-pro-latest")
-                    print("Gemini 請求發送中")
+                    logger.debug("Gemini 請求發送中", extra={"talk_id": request.talk_id, "max_tokens": request.max_tokens,
+                                                           "messages": len(prompt_messages),
+                                                           "prompt": redact(request.user_message)})
 
-                    user_prompt = prompt_messages[-1]["content"]
-                    print("Gemini Prompt Content:", user_prompt)
-
-                    result = model.generate_content(user_prompt)
+                    with observe_llm(provider, _deployment(model_api), "chat"):
+                        result = await gemini.generate(model_api, prompt_messages, _gemini_config(request))
                     assistant_message = result.text
-
-                    print("Gemini 回覆成功")
+                    usage = gemini_usage(result, prompt_messages, assistant_message)
+                    logger.debug("Gemini 回覆成功", extra={"talk_id": request.talk_id, "prompt_tokens": usage.prompt_tokens,
+                                                         "cached_tokens": usage.cached_tokens,
+                                                         "completion_tokens": usage.completion_tokens})
 
                 except Exception as e:
-                    print("Gemini 發生錯誤：", str(e))
+                    logger.warning("Gemini 發生錯誤：%s", e, extra={"talk_id": request.talk_id})
                     raise HTTPException(status_code=500, detail=f"Gemini API 錯誤：{str(e)}")
 
             else:
@@ -147,21 +168,27 @@ async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
             break
         except Exception as e:
             if attempt == max_retries - 1:
+                logger.warning("模型 API 失敗：%s", e, extra={"talk_id": request.talk_id, "provider": provider})
                 raise HTTPException(status_code=500, detail=f"API 失敗: {str(e)}")
-            time.sleep(1)  # 等待 1 秒再重試
+            await asyncio.sleep(1)  # 等待 1 秒再重試
 
-    # 儲存對話記錄到資料庫
-    user_msg = ChatMessage(talk_id=request.talk_id, sender="user", message=request.user_message)
-    assistant_msg = ChatMessage(talk_id=request.talk_id, sender="assistant", message=assistant_message)
+    record_tokens(provider, _deployment(model_api), usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens)
+
+    # 儲存對話記錄與 token 用量到資料庫
+    user_msg = ChatMessage(talk_id=request.talk_id, sender="user", message=request.user_message,
+                           token_count=count_tokens(request.user_message))
+    assistant_msg = ChatMessage(talk_id=request.talk_id, sender="assistant", message=assistant_message,
+                                token_count=count_tokens(assistant_message), model_api_id=model_api.id,
+                                prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
     
     db.add(user_msg)
     db.add(assistant_msg)
-    db.commit()
-    db.refresh(user_msg)
-    db.refresh(assistant_msg)
+    await add_daily_usage(db, model_api.user_id, model_api.id, "chat", usage)
+    await db.commit()
+    context_cache.append_messages(request.talk_id, [user_msg, assistant_msg])
 
-    # ✅ 嘗試自動生成記憶（每 10 則對話）
-    generate_memory(db, request.talk_id, session.role_id, session.id,5)
+    # ✅ 回應送出後才排入自動記憶工作（每 5 則訊息）
+    background_tasks.add_task(enqueue_memory_job, request.talk_id, ctx.role_id, model_api.id, 5)
     return {
         "talk_id": request.talk_id,
         "user_message_id": user_msg.id,
@@ -170,24 +197,190 @@ async def send_message(request: ChatRequest, db: Session = Depends(get_db)):
         "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
     }
 
-@router.get("/api/chat/{talk_id}/history", response_model=ChatHistoryResponse)
-def get_chat_history(talk_id: int, limit: int = 10, offset: int = 0, db: Session = Depends(get_db)):
-    messages = db.query(ChatMessage) \
-        .filter(ChatMessage.talk_id == talk_id) \
-        .order_by(ChatMessage.id.desc()) \
-        .limit(limit).offset(offset).all()
-    
-    has_more = db.query(ChatMessage).filter(ChatMessage.talk_id == talk_id).count() > (limit + offset)
-    
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _gemini_config(request: ChatRequest) -> dict:
+    return gemini.generation_config(
+        max_tokens=request.max_tokens,
+        temperature=request.temperature,
+        top_p=request.top_p,
+        presence_penalty=request.presence_penalty,
+        frequency_penalty=request.frequency_penalty,
+    )
+
+
+def _stream_usage_supported(config: dict) -> bool:
+    # stream_options.include_usage 需要 2024-09-01-preview 之後的 Azure API 版本，較舊的版本改在本地計算
+    return config.get("api_version", AZURE_API_VERSION) >= AZURE_STREAM_USAGE_API_VERSION
+
+
+async def _stream_completion(model_api: CachedModelAPI, prompt_messages: list, request: ChatRequest, usage: dict):
+    """
+    逐段產生供應商回覆的文字片段；串流結束後 usage["reported"] 為供應商回報的用量（沒有則不設定）
+    """
+    config = model_api.config
+    if model_api.provider == "azure":
+        client = get_client(model_api)
+        extra = {"stream_options": {"include_usage": True}} if _stream_usage_supported(config) else {}
+        response = await client.chat.completions.create(
+            model=config["deployment_name"],
+            messages=prompt_messages,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            top_p=request.top_p,
+            presence_penalty=request.presence_penalty,
+            frequency_penalty=request.frequency_penalty,
+            stream=True,
+            **extra
+        )
+        async for chunk in response:
+            # include_usage 時最後一個 chunk 只有用量
+            if chunk.usage:
+                usage["reported"] = openai_usage(chunk.usage, prompt_messages, None)
+            # Azure 第一個 chunk 可能只有內容過濾結果，沒有 choices
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    elif model_api.provider == "gemini":
+        result = await gemini.generate(model_api, prompt_messages, _gemini_config(request), stream=True)
+        async for chunk in result:
+            if chunk.parts:
+                yield chunk.text
+        if getattr(result, "usage_metadata", None):
+            usage["reported"] = gemini_usage(result, prompt_messages, None)
+
+    else:
+        raise HTTPException(status_code=400, detail="不支援的供應商")
+
+
+async def _save_stream_result(talk_id: int, user_message: str, assistant_message: str,
+                              model_api: CachedModelAPI, usage: TokenUsage):
+    """
+    串流結束後才寫入資料庫（原本的 db 會在回應開始時關閉，需另開連線）
+    """
+    async with AsyncSessionLocal() as stream_db:
+        user_msg = ChatMessage(talk_id=talk_id, sender="user", message=user_message,
+                               token_count=count_tokens(user_message))
+        assistant_msg = ChatMessage(talk_id=talk_id, sender="assistant", message=assistant_message,
+                                    token_count=count_tokens(assistant_message), model_api_id=model_api.id,
+                                    prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        stream_db.add(user_msg)
+        stream_db.add(assistant_msg)
+        await add_daily_usage(stream_db, model_api.user_id, model_api.id, "chat", usage)
+        await stream_db.commit()
+        context_cache.append_messages(talk_id, [user_msg, assistant_msg])
+        return user_msg.id, assistant_msg.id
+
+
+@router.post("/api/chat/stream", dependencies=[query_budget(6)])
+async def stream_message(request: ChatRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    以 Server-Sent Events 串流回應 AI 內容，完成後才寫入對話紀錄
+    """
+    ctx, prompt_messages, model_api = await prepare_chat(request, db)
+    if model_api.provider not in ("azure", "gemini"):
+        raise HTTPException(status_code=400, detail="不支援的供應商")
+
+    talk_id = request.talk_id
+    role_id = ctx.role_id
+    model_api_id = model_api.id
+    # 串流完成後才加入自動記憶工作，於回應結束後執行
+    background_tasks = BackgroundTasks()
+
+    async def event_stream():
+        started = time.perf_counter()
+        first_token_ms = None
+        chunks = []
+        usage = {}
+        deployment = _deployment(model_api)
+        try:
+            with observe_llm(model_api.provider, deployment, "chat_stream"):
+                async for delta in _stream_completion(model_api, prompt_messages, request, usage):
+                    if first_token_ms is None:
+                        first_token_ms = round((time.perf_counter() - started) * 1000)
+                        observe_ttft(model_api.provider, deployment, first_token_ms / 1000)
+                        logger.debug("串流首字延遲", extra={"talk_id": talk_id, "ttft_ms": first_token_ms})
+                    chunks.append(delta)
+                    yield _sse("delta", {"content": delta})
+        except Exception as e:
+            logger.warning("串流發生錯誤：%s", e, extra={"talk_id": talk_id, "provider": model_api.provider})
+            yield _sse("error", {"detail": f"API 失敗: {str(e)}"})
+            return
+
+        assistant_message = "".join(chunks)
+        # 供應商沒有回報用量時，以本地計算的數字為準
+        final_usage = usage.get("reported") or local_usage(prompt_messages, assistant_message)
+        record_tokens(model_api.provider, deployment, final_usage.prompt_tokens, final_usage.completion_tokens,
+                      final_usage.cached_tokens)
+        user_message_id, assistant_message_id = await _save_stream_result(
+            talk_id, request.user_message, assistant_message, model_api, final_usage
+        )
+        background_tasks.add_task(enqueue_memory_job, talk_id, role_id, model_api_id, 5)
+        yield _sse("done", {
+            "talk_id": talk_id,
+            "user_message_id": user_message_id,
+            "assistant_message_id": assistant_message_id,
+            "time_to_first_token_ms": first_token_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks
+    )
+
+@router.get("/api/chat/{talk_id}/history", response_model=ChatHistoryResponse, dependencies=[query_budget(3)])
+async def get_chat_history(
+    talk_id: int,
+    background_tasks: BackgroundTasks,
+    limit: int = Query(10, ge=1, le=100),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    以游標分頁讀取歷史訊息（新到舊）：
+    - before_id：往上捲動，取 id 小於游標的較舊訊息
+    - after_id：取 id 大於游標的較新訊息
+    多取一筆判斷 has_more，不需要 COUNT(*)；靠 (talk_id, id) 索引，成本與對話長度無關
+    """
+    stmt = select(ChatMessage).filter(ChatMessage.talk_id == talk_id)
+    if after_id is not None:
+        stmt = stmt.filter(ChatMessage.id > after_id).order_by(ChatMessage.id.asc())
+    else:
+        if before_id is not None:
+            stmt = stmt.filter(ChatMessage.id < before_id)
+        stmt = stmt.order_by(ChatMessage.id.desc())
+
+    messages = list((await db.execute(stmt.limit(limit + 1))).scalars().all())
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after_id is not None:
+        messages.reverse()
+
+    # 開啟聊天頁時預載熱資料快取，回應送出後才執行
+    if before_id is None and after_id is None:
+        background_tasks.add_task(context_cache.warm_session, talk_id)
+
     return {
         "talk_id": talk_id,
         "messages": messages,
-        "has_more": has_more
+        "has_more": has_more,
+        # 繼續往上捲動時帶入的 before_id
+        "next_before_id": messages[-1].id if messages else before_id
     }
 
 @router.put("/api/chat/message/{message_id}")
-def update_message(message_id: int, request: UpdateMessageRequest, db: Session = Depends(get_db)):
-    message = db.query(ChatMessage).filter(ChatMessage.id == message_id).first()
+async def update_message(message_id: int, request: UpdateMessageRequest, db: AsyncSession = Depends(get_async_db)):
+    message = await db.get(ChatMessage, message_id)
     
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
@@ -197,9 +390,11 @@ def update_message(message_id: int, request: UpdateMessageRequest, db: Session =
 
     old_message = message.message
     message.message = request.new_message
+    message.token_count = count_tokens(request.new_message)
     message.updated_at = datetime.utcnow()  # 確保 `updated_at` 被更新
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
+    context_cache.invalidate_session(message.talk_id)
 
 
     return {
@@ -209,102 +404,31 @@ def update_message(message_id: int, request: UpdateMessageRequest, db: Session =
         "updated_at": message.updated_at
     }
 
-def generate_memory(db: Session, talk_id: int, role_id: int, session_id: int, message_count: int):
-    from tiktoken import encoding_for_model  # 用於 token 計算
-    try:
-        # 總對話筆數
-        total = db.query(ChatMessage).filter(ChatMessage.talk_id == talk_id).count()
-        if total % message_count != 0:  # ✅ 每 10 則觸發一次
-            print("本次不生成回憶")
-            return
-        print("組織生成記憶prompt")
-
-        # 抓最近 10 則訊息（新到舊）
-        recent = (
-            db.query(ChatMessage)
-            .filter(ChatMessage.talk_id == talk_id)
-            .order_by(ChatMessage.timestamp.desc())
-            .limit(message_count).all()
-        )
-        recent = list(reversed(recent))
-        print("recent")  # 轉成舊到新
-
-        # 組合對話內容
-        context = "\n".join([f"{m.sender}：{m.message}" for m in recent])
-
-        # 設計 Prompt
-        summary_prompt = [
-            {
-                "role": "system",
-                "content": "你是小說寫作助手，請根據以下 5 輪對話（共 10 則訊息），整理出一句具體的事件或記憶摘要（不超過 100 字），並加上 1～3 個合適的分類標籤。\n\n格式如下：\n記憶內容：...\n標籤：...\n"
-            },
-            {
-                "role": "user",
-                "content": context
-            }
-        ]
-
-        # 呼叫模型
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
-            messages=summary_prompt,
-            temperature=0.5,
-            max_tokens=200
-        )
-        result = response.choices[0].message.content
-        print("模型回覆")
-        print(result)
-
-        # 解析回傳內容
-        lines = result.strip().splitlines()
-        memory_text = ""
-        tags = ""
-        for line in lines:
-            if line.startswith("記憶內容："):
-                memory_text = line.replace("記憶內容：", "").strip()
-            elif line.startswith("標籤："):
-                tags = line.replace("標籤：", "").strip()
-
-        # Token 計算（選擇性）
-        enc = encoding_for_model("gpt-4")
-        token_count = len(enc.encode(memory_text))
-
-        # 寫入記憶體資料表
-        db.add(Memory(
-            role_id=role_id,
-            session_id=session_id,
-            content=memory_text,
-            token_count=token_count,
-            tags=tags,
-            is_active=True,
-            selected=False
-        ))
-        db.commit()
-        print("[✅] 自動記憶生成成功")
-    except Exception as e:
-        print(f"[⚠️] 自動記憶生成失敗：{e}")
-
 @router.delete("/api/chat/message/{message_id}")
-def delete_message(message_id: int, db: Session = Depends(get_db)):
-    message = db.query(ChatMessage).filter(ChatMessage.id == message_id).first()
+async def delete_message(message_id: int, db: AsyncSession = Depends(get_async_db)):
+    message = await db.get(ChatMessage, message_id)
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
-    db.delete(message)
-    db.commit()
+    await db.delete(message)
+    await db.commit()
+    context_cache.invalidate_session(message.talk_id)
 
     return {"message": f"Message {message_id} deleted successfully"}
 
 
 @router.get("/api/sessions/{session_id}/role", response_model=RoleSchema)
-def read_role_by_session(session_id: int, request: Request, db: Session = Depends(get_db)):
-    role = get_role_by_session(db, session_id)
+async def read_role_by_session(session_id: int, request: Request, db: AsyncSession = Depends(get_async_read_db)):
+    role = await get_role_by_session(db, session_id)
     if not role:
         raise HTTPException(status_code=404, detail="Role not found for session")
 
-    # 加上完整圖片網址
-    if role.image:
-        base_url = str(request.base_url).rstrip("/")
-        role.image = f"{base_url}/{role.image}"
-
-    return role
\ No newline at end of file
+    # 加上完整圖片網址（帶版本），不修改 ORM 物件
+    return RoleSchema(
+        id=role.id,
+        name=role.name,
+        age=role.age,
+        occupation=role.occupation,
+        description=role.description,
+        image=image_url(str(request.base_url), role.image),
+    )
\ No newline at end of file
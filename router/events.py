@@ -1,8 +1,11 @@
 # routers/events.py
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import database, schemas, repository
-from typing import List
+from typing import List, Optional
+from utils.pagination import ListParams, page, ndjson_response
+from utils.sql_profiler import query_budget
 import models
 
 
@@ -12,31 +15,44 @@ router = APIRouter(
     tags=["events"]
 )
 
-@router.get("/", response_model=list[schemas.EventOut])
-def read_events(db: Session = Depends(database.get_db)):
-    return repository.get_events(db)
+@router.get("/", response_model=list[schemas.EventOut], dependencies=[query_budget(1)])
+async def read_events(
+    response: Response,
+    params: ListParams = Depends(),
+    user_id: Optional[int] = None,
+    role_id: Optional[int] = None,
+    session_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    selected: Optional[bool] = None,
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    filters = dict(user_id=user_id, role_id=role_id, session_id=session_id, is_active=is_active, selected=selected)
+    if params.format == "ndjson":
+        return ndjson_response(repository.events_query(params.cursor, **filters), schemas.EventOut)
+    events = await repository.get_events(db, params.limit, params.cursor, **filters)
+    return page(events, params.limit, response.headers)
 
 @router.get("/{event_id}", response_model=schemas.EventOut)
-def read_event(event_id: int, db: Session = Depends(database.get_db)):
-    event = repository.get_event_by_id(db, event_id)
+async def read_event(event_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    event = await repository.get_event_by_id(db, event_id)
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     return event
 
 @router.post("/", response_model=schemas.EventOut)
-def create_event(event: schemas.EventCreate, db: Session = Depends(database.get_db)):
-    return repository.create_event(db, event)
+async def create_event(event: schemas.EventCreate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.create_event(db, event)
 
 @router.put("/{event_id}", response_model=schemas.EventOut)
-def update_event(event_id: int, event: schemas.EventUpdate, db: Session = Depends(database.get_db)):
-    return repository.update_event(db, event_id, event)
+async def update_event(event_id: int, event: schemas.EventUpdate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.update_event(db, event_id, event)
 
 @router.delete("/{event_id}")
-def delete_event(event_id: int, db: Session = Depends(database.get_db)):
-    repository.delete_event(db, event_id)
+async def delete_event(event_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    await repository.delete_event(db, event_id)
     return {"message": "Event deleted"}
 
 @router.get("/session/{session_id}", response_model=List[schemas.EventOut])
-def get_events_by_session(session_id: int, db: Session = Depends(database.get_db)):
-    events = db.query(models.Event).filter(models.Event.session_id == session_id).all()
-    return events
+async def get_events_by_session(session_id: int, db: AsyncSession = Depends(database.get_async_read_db)):
+    result = await db.execute(select(models.Event).filter(models.Event.session_id == session_id))
+    return result.scalars().all()
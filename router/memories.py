@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import schemas, repository, database
-from typing import List
+from typing import List, Optional
+from utils.pagination import ListParams, page, ndjson_response
+from utils.sql_profiler import query_budget
 import models
 
 router = APIRouter(
@@ -9,31 +12,44 @@ router = APIRouter(
     tags=["memories"]
 )
 
-@router.get("/", response_model=list[schemas.MemoryOut])
-def read_memories(db: Session = Depends(database.get_db)):
-    return repository.get_memories(db)
+@router.get("/", response_model=list[schemas.MemoryOut], dependencies=[query_budget(1)])
+async def read_memories(
+    response: Response,
+    params: ListParams = Depends(),
+    user_id: Optional[int] = None,
+    role_id: Optional[int] = None,
+    session_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    selected: Optional[bool] = None,
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    filters = dict(user_id=user_id, role_id=role_id, session_id=session_id, is_active=is_active, selected=selected)
+    if params.format == "ndjson":
+        return ndjson_response(repository.memories_query(params.cursor, **filters), schemas.MemoryOut)
+    memories = await repository.get_memories(db, params.limit, params.cursor, **filters)
+    return page(memories, params.limit, response.headers)
 
 @router.get("/{memory_id}", response_model=schemas.MemoryOut)
-def read_memory(memory_id: int, db: Session = Depends(database.get_db)):
-    memory = repository.get_memory_by_id(db, memory_id)
+async def read_memory(memory_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    memory = await repository.get_memory_by_id(db, memory_id)
     if memory is None:
         raise HTTPException(status_code=404, detail="Memory not found")
     return memory
 
 @router.post("/", response_model=schemas.MemoryOut)
-def create_memory(memory: schemas.MemoryCreate, db: Session = Depends(database.get_db)):
-    return repository.create_memory(db, memory)
+async def create_memory(memory: schemas.MemoryCreate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.create_memory(db, memory)
 
 @router.put("/{memory_id}", response_model=schemas.MemoryOut)
-def update_memory(memory_id: int, memory: schemas.MemoryUpdate, db: Session = Depends(database.get_db)):
-    return repository.update_memory(db, memory_id, memory)
+async def update_memory(memory_id: int, memory: schemas.MemoryUpdate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.update_memory(db, memory_id, memory)
 
 @router.delete("/{memory_id}")
-def delete_memory(memory_id: int, db: Session = Depends(database.get_db)):
-    repository.delete_memory(db, memory_id)
+async def delete_memory(memory_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    await repository.delete_memory(db, memory_id)
     return {"message": "Memory deleted"}
 
 @router.get("/session/{session_id}", response_model=List[schemas.MemoryOut])
-def get_memory_by_session(session_id: int, db: Session = Depends(database.get_db)):
-    events = db.query(models.Memory).filter(models.Memory.session_id == session_id).all()
-    return events
+async def get_memory_by_session(session_id: int, db: AsyncSession = Depends(database.get_async_read_db)):
+    result = await db.execute(select(models.Memory).filter(models.Memory.session_id == session_id))
+    return result.scalars().all()
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import database, schemas, models
+from typing import List
+
+router = APIRouter(
+    prefix="/api/memory-jobs",
+    tags=["memory-jobs"]
+)
+
+@router.get("/{job_id}", response_model=schemas.MemoryJobOut)
+async def read_memory_job(job_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    job = await db.get(models.MemoryJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Memory job not found")
+    return job
+
+@router.get("/session/{session_id}", response_model=List[schemas.MemoryJobOut])
+async def get_memory_jobs_by_session(session_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    result = await db.execute(
+        select(models.MemoryJob).filter(models.MemoryJob.session_id == session_id).order_by(models.MemoryJob.id.desc())
+    )
+    return result.scalars().all()
@@ -1,15 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
 from sqlalchemy.orm import Session
-from models import Role, User,ChatSession
-from database import get_db
-from repository import get_role_or_404, delete_role, get_roles_by_user
-from utils.auth import get_current_user
-import os, shutil
-from urllib.parse import urljoin
+from typing import Optional
+from models import Role, ChatSession
+from database import get_db, get_read_db
+from repository import get_role_or_404, delete_role, role_cards_query, chatting_role_cards_query, role_cards_version
+from utils.auth import Principal, get_current_user
+from utils import context_cache
+from utils.pagination import ListParams, page, ndjson_response
+from utils.http_cache import cached_json, etag_matches, not_modified, version_etag
+from utils.images import save_upload, image_url
+from utils.sql_profiler import query_budget
 
 router = APIRouter(prefix="/api/roles", tags=["角色"])
 
-UPLOAD_DIR = "uploads"
 @router.post("/create")
 async def create_role(
     name: str = Form(...),
@@ -21,15 +24,12 @@ async def create_role(
     hobbies: str = Form(None),
     worldview: str = Form(None),
     category: str = Form(None),
+    is_public: bool = Form(False),
     image: UploadFile = File(None),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)  # ✅ 新增這行
+    current_user: Principal = Depends(get_current_user)  # ✅ 新增這行
 ):
-    image_filename = None
-    if image:
-        image_filename = f"{UPLOAD_DIR}/{image.filename}"
-        with open(image_filename, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
+    image_filename = await save_upload(image) if image else None
 
     new_role = Role(
         name=name,
@@ -42,6 +42,7 @@ async def create_role(
         worldview=worldview,
         category=category,
         image=image_filename,
+        is_public=is_public,
         user_id=current_user.id   # ✅ 重點：記錄是哪個使用者創的
     )
 
@@ -51,67 +52,67 @@ async def create_role(
     return new_role
 
 
-@router.get("/list")
-def get_roles(request: Request, db: Session = Depends(get_db)):
-    roles = db.query(Role).all()
-    for role in roles:
-        if role.image:
-            clean_path = role.image.lstrip("/")
-            role.image = urljoin(str(request.base_url), clean_path)
-    return roles
-
-@router.get("/my")
-def get_my_roles(request: Request,db: Session = Depends(get_db), current_user=Depends(get_current_user)):
-    roles = get_roles_by_user(db, current_user.id)
-    
-    for role in roles:
-        if role.image:
-            clean_path = role.image.lstrip("/")
-            role.image = urljoin(str(request.base_url), clean_path)
-    return [{
-        "id": r.id,
-        "name": r.name,
-        "age": r.age,
-        "occupation": r.occupation,
-        "description": r.description,
-        "image": r.image,
-    } for r in roles]
-
-
-@router.get("/public")
-def get_public_roles(request: Request, db: Session = Depends(get_db)):
-    roles = db.query(Role).filter(Role.is_public == True).all()
-    for role in roles:
-        if role.image:
-            clean_path = role.image.lstrip("/")
-            role.image = urljoin(str(request.base_url), clean_path)
-    return roles
-
-@router.get("/chatting")
-def get_chatting_roles(
+# 角色卡片：由欄位投影的 Row 組成，圖片網址另外組合（帶版本的縮圖），不修改 ORM 物件
+def _card(row, base_url: str) -> dict:
+    card = dict(row._mapping)
+    card["image"] = image_url(base_url, card["image"], thumbnail=True)
+    return card
+
+
+def _card_response(request: Request, db: Session, stmt, limit: int | None = None):
+    """
+    角色卡片列表：ETag 由請求網址與目錄版本（role_cards_version）組成，相符時直接回 304，不查詢、不組合列表
+    """
+    etag = version_etag(request.url, *role_cards_version(db, stmt))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    headers = {}
+    rows = db.execute(stmt).all()
+    if limit is not None:
+        rows = page(rows, limit, headers)
+    base_url = str(request.base_url)
+    return cached_json(request, [_card(row, base_url) for row in rows], headers, etag=etag)
+
+
+def _card_list(request: Request, db: Session, params: ListParams, **filters):
+    if params.format == "ndjson":
+        base_url = str(request.base_url)
+        return ndjson_response(role_cards_query(params.cursor, **filters), lambda row: _card(row, base_url), entities=False)
+    stmt = role_cards_query(params.cursor, **filters).limit(params.limit + 1)
+    return _card_response(request, db, stmt, params.limit)
+
+
+@router.get("/list", dependencies=[query_budget(2)])
+def get_roles(
     request: Request,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
+    params: ListParams = Depends(),
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_read_db)
 ):
-    # 找出該使用者的所有聊天記錄
-    session_query = db.query(ChatSession).filter(ChatSession.user_id == current_user.id).all()
-    role_ids = list({session.role_id for session in session_query})  # 用 set 去重複
+    return _card_list(request, db, params, user_id=user_id)
+
+@router.get("/my", dependencies=[query_budget(2)])
+def get_my_roles(request: Request, db: Session = Depends(get_read_db), current_user: Principal = Depends(get_current_user)):
+    return _card_response(request, db, role_cards_query(user_id=current_user.id))
+
 
-    # 查出角色資訊
-    roles = db.query(Role).filter(Role.id.in_(role_ids)).all()
+@router.get("/public", dependencies=[query_budget(2)])
+def get_public_roles(request: Request, params: ListParams = Depends(), db: Session = Depends(get_read_db)):
+    return _card_list(request, db, params, is_public=True)
 
-    for role in roles:
-        if role.image:
-            clean_path = role.image.lstrip("/")
-            role.image = urljoin(str(request.base_url), clean_path)
-    return roles
+@router.get("/chatting", dependencies=[query_budget(2)])
+def get_chatting_roles(
+    request: Request,
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    return _card_response(request, db, chatting_role_cards_query(current_user.id))
 
 @router.get("/{id}")
-def get_role(id: int, request: Request, db: Session = Depends(get_db)):
+def get_role(id: int, request: Request, db: Session = Depends(get_read_db)):
     role = db.query(Role).filter(Role.id == id).first()
     if not role:
         raise HTTPException(status_code=404, detail="角色不存在")
-    image_url = f"{request.base_url}{role.image}" if role.image else None
     return {
         "id": role.id,
         "name": role.name,
@@ -123,7 +124,7 @@ def get_role(id: int, request: Request, db: Session = Depends(get_db)):
         "hobbies": role.hobbies,
         "worldview": role.worldview,
         "category": role.category,
-        "image": image_url
+        "image": image_url(str(request.base_url), role.image)
     }
 
 @router.put("/update/{id}")
@@ -138,6 +139,7 @@ async def update_role(
     hobbies: str = Form(None),
     worldview: str = Form(None),
     category: str = Form(None),
+    is_public: Optional[bool] = Form(None),
     image: UploadFile = File(None),
     db: Session = Depends(get_db),
 ):
@@ -146,13 +148,7 @@ async def update_role(
         raise HTTPException(status_code=404, detail="角色不存在")
 
     if image:
-        ext = image.filename.split('.')[-1].lower()
-        if ext not in ["jpg", "jpeg", "png", "gif"]:
-            raise HTTPException(status_code=400, detail="只允許上傳圖片")
-        filename = f"{UPLOAD_DIR}/{id}.{ext}"
-        with open(filename, "wb") as buffer:
-            shutil.copyfileobj(image.file, buffer)
-        role.image = filename
+        role.image = await save_upload(image)
 
     role.name = name
     role.age = age
@@ -163,8 +159,11 @@ async def update_role(
     role.hobbies = hobbies
     role.worldview = worldview
     role.category = category
+    if is_public is not None:  # 未傳入時維持原設定
+        role.is_public = is_public
 
     db.commit()
+    context_cache.invalidate_role(id)  # 角色設定已變更，重新組合聊天 Prompt 中的角色區塊
     db.refresh(role)
     return role
 
@@ -1,38 +1,54 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import database, schemas, repository, models
-from typing import List
+from typing import List, Optional
+from utils.pagination import ListParams, page, ndjson_response
+from utils.sql_profiler import query_budget
 
 router = APIRouter(
     prefix="/api/sessions",
     tags=["sessions"]
 )
 
-@router.get("/", response_model=list[schemas.ChatSessionOut])
-def read_sessions(db: Session = Depends(database.get_db)):
-    return repository.get_sessions(db)
+@router.get("/", response_model=list[schemas.ChatSessionOut], dependencies=[query_budget(1)])
+async def read_sessions(
+    response: Response,
+    params: ListParams = Depends(),
+    user_id: Optional[int] = None,
+    role_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    db: AsyncSession = Depends(database.get_async_read_db)
+):
+    filters = dict(user_id=user_id, role_id=role_id, is_active=is_active)
+    if params.format == "ndjson":
+        return ndjson_response(repository.sessions_query(params.cursor, **filters), schemas.ChatSessionOut)
+    sessions = await repository.get_sessions(db, params.limit, params.cursor, **filters)
+    return page(sessions, params.limit, response.headers)
 
 @router.get("/{session_id}", response_model=schemas.ChatSessionOut)
-def read_session(session_id: int, db: Session = Depends(database.get_db)):
-    session = repository.get_session_by_id(db, session_id)
+async def read_session(session_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    session = await repository.get_session_by_id(db, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
 
 @router.post("/", response_model=schemas.ChatSessionOut)
-def create_session(session: schemas.ChatSessionCreate, db: Session = Depends(database.get_db)):
-    return repository.create_session(db, session)
+async def create_session(session: schemas.ChatSessionCreate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.create_session(db, session)
 
 @router.put("/{session_id}", response_model=schemas.ChatSessionOut)
-def update_session(session_id: int, session: schemas.ChatSessionUpdate, db: Session = Depends(database.get_db)):
-    return repository.update_session(db, session_id, session)
+async def update_session(session_id: int, session: schemas.ChatSessionUpdate, db: AsyncSession = Depends(database.get_async_db)):
+    return await repository.update_session(db, session_id, session)
 
 @router.delete("/{session_id}")
-def delete_session(session_id: int, db: Session = Depends(database.get_db)):
-    repository.delete_session(db, session_id)
+async def delete_session(session_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    await repository.delete_session(db, session_id)
     return {"message": "Session deleted"}
 
 @router.get("/by-role/{role_id}", response_model=List[schemas.ChatSessionOut])
-def get_sessions_by_role(role_id: int, db: Session = Depends(database.get_db)):
-    sessions = db.query(models.ChatSession).filter(models.ChatSession.role_id == role_id).order_by(models.ChatSession.created_at.desc()).all()
-    return sessions
+async def get_sessions_by_role(role_id: int, db: AsyncSession = Depends(database.get_async_read_db)):
+    result = await db.execute(
+        select(models.ChatSession).filter(models.ChatSession.role_id == role_id).order_by(models.ChatSession.created_at.desc())
+    )
+    return result.scalars().all()
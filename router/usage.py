@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
+import database, schemas, repository
+from utils.auth import Principal, get_current_user
+from utils.sql_profiler import query_budget
+
+router = APIRouter(
+    prefix="/api/usage",
+    tags=["usage"]
+)
+
+# 查詢範圍上限（天）
+USAGE_MAX_DAYS = 366
+
+
+@router.get("/daily", response_model=List[schemas.TokenUsageDailyOut], dependencies=[query_budget(1)])
+async def read_daily_usage(
+    start: Optional[date] = Query(None, description="起始日（UTC，含），預設為 30 天前"),
+    end: Optional[date] = Query(None, description="結束日（UTC，含），預設為今天"),
+    model_api_id: Optional[int] = None,
+    kind: Optional[Literal["chat", "memory"]] = None,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    目前使用者的金鑰每日 token 用量（依金鑰與用途分列）
+    """
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="起始日不可晚於結束日")
+    if (end - start).days >= USAGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"查詢範圍不可超過 {USAGE_MAX_DAYS} 天")
+    return await repository.get_daily_usage(db, current_user.id, start, end, model_api_id=model_api_id, kind=kind)
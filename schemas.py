@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, computed_field
 from typing import Optional, List, Dict
-from datetime import datetime
+from datetime import date, datetime
 # 定義角色請求的 Schema
 class RoleCreate(BaseModel):
     name: str
@@ -38,6 +38,8 @@ class ChatMessageSchema(BaseModel):
     message: str
     timestamp: datetime
     updated_at: Optional[datetime] = None
+    prompt_tokens: Optional[int] = None       # 僅 assistant 訊息有值
+    completion_tokens: Optional[int] = None
 
     class Config:
         from_attributes = True  # 允許 Pydantic 直接從 ORM 轉換
@@ -47,6 +49,7 @@ class ChatHistoryResponse(BaseModel):
     talk_id: int
     messages: List[ChatMessageSchema]
     has_more: bool
+    next_before_id: Optional[int] = None
 
 # 更新訊息 API 的請求格式
 class UpdateMessageRequest(BaseModel):
@@ -205,4 +208,40 @@ class ModelAPIOut(ModelAPIBase):
     created_at: datetime
 
     class Config:
-        from_attributes = True  # Pydantic v2
\ No newline at end of file
+        from_attributes = True  # Pydantic v2
+
+class MemoryJobOut(BaseModel):
+    id: int
+    session_id: int
+    role_id: int
+    model_api_id: Optional[int] = None
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    next_run_at: Optional[datetime] = None
+    memory_id: Optional[int] = None
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class TokenUsageDailyOut(BaseModel):
+    day: date
+    model_api_id: int
+    kind: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_prompt_tokens: int
+
+    @computed_field
+    @property
+    def cache_hit_rate(self) -> Optional[float]:
+        # prompt 中命中供應商 prompt cache 的比例
+        if not self.prompt_tokens:
+            return None
+        return round(self.cached_prompt_tokens / self.prompt_tokens, 4)
+
+    class Config:
+        from_attributes = True
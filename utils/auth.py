@@ -1,15 +1,33 @@
 from passlib.context import CryptContext
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
 from models import User
-from database import get_db
+from database import SessionLocal
+import asyncio
+import hashlib
 import os
+import threading
+import time
+
+# bcrypt 成本（log2 rounds）；調高後，舊雜湊會在使用者下次登入時自動重新雜湊
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# 密碼雜湊 / 驗證專用的執行緒數，限制同時進行的 bcrypt 運算
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
 
 # 密碼加密器
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+)
+# bcrypt 會釋放 GIL，放在獨立的執行緒池，不佔用事件迴圈與一般路由的執行緒池
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 
 # Token 認證方式
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
@@ -19,6 +37,10 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "secret")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
 
+# 已驗證的 Token 快取：避免每個請求都查詢 users
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 4096))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", 60))
+
 
 # ======== 密碼處理 ========
 
@@ -28,9 +50,26 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """
+    驗證密碼；雜湊設定（如 BCRYPT_ROUNDS）變更時一併回傳新雜湊，呼叫端需寫回資料庫
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _hash_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
 
 # ======== JWT Token ========
 
+def password_fingerprint(hashed_password: str) -> str:
+    """
+    舊版 Token 的密碼指紋（pwd）；新 Token 改記錄 users.token_version（ver），重新雜湊不會使 Token 失效
+    """
+    return hashlib.sha256(hashed_password.encode("utf-8")).hexdigest()[:16]
+
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -46,11 +85,60 @@ def decode_access_token(token: str) -> dict | None:
 
 # ======== 取得目前登入使用者 ========
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+@dataclass(frozen=True)
+class Principal:
+    """
+    目前登入使用者的快照（非 ORM 物件，可跨請求共用）
+    """
+    id: int
+    username: str
+    created_at: datetime | None
+    claims: dict
+
+
+# token -> Principal
+_principals: TTLCache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+# 同步路由在執行緒池中執行，需上鎖
+_lock = threading.Lock()
+
+
+def invalidate_user(user_id: int):
+    """
+    密碼變更或刪除使用者時呼叫，移除該使用者所有快取的 Token
+    """
+    with _lock:
+        for token in [t for t, p in _principals.items() if p.id == user_id]:
+            _principals.pop(token, None)
+
+
+def _load_principal(payload: dict) -> Principal:
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.id == payload["user_id"]).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="使用者不存在")
+        # 變更密碼後 token_version 遞增，舊 Token 即失效；舊版 Token 仍以密碼指紋檢查，更早的 Token 兩者皆無，不檢查
+        if "ver" in payload:
+            revoked = payload["ver"] != user.token_version
+        else:
+            revoked = "pwd" in payload and payload["pwd"] != password_fingerprint(user.password)
+        if revoked:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token 已失效，請重新登入")
+        return Principal(id=user.id, username=user.username, created_at=user.created_at, claims=payload)
+
+
+def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    with _lock:
+        principal = _principals.get(token)
+    if principal is not None:
+        if principal.claims.get("exp", 0) > time.time():
+            return principal
+        with _lock:
+            _principals.pop(token, None)
+
     payload = decode_access_token(token)
     if not payload or "user_id" not in payload:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無效的 Token")
-    user = db.query(User).filter(User.id == payload["user_id"]).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="使用者不存在")
-    return user
+    principal = _load_principal(payload)
+    with _lock:
+        _principals[token] = principal
+    return principal
@@ -0,0 +1,169 @@
+import os
+from functools import lru_cache
+
+# 依 token 預算組合聊天 Prompt：固定前綴（指示、角色、規則、背景、釘選記憶）在前，記憶與近期對話在後
+
+# 模型 context 總預算（可由 ModelAPI.config["context_tokens"] 覆寫），需扣掉回覆的 max_tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 8000))
+# 記憶最多佔用的預算比例
+CONTEXT_MEMORY_RATIO = float(os.getenv("CONTEXT_MEMORY_RATIO", 0.3))
+# 每次最多從資料庫取回的近期訊息數（再依預算裁切）
+CONTEXT_HISTORY_LIMIT = int(os.getenv("CONTEXT_HISTORY_LIMIT", 50))
+# 每則訊息在 chat 格式中的額外 token（role、分隔符號）
+MESSAGE_OVERHEAD_TOKENS = 4
+DEFAULT_ENCODING_MODEL = "gpt-4"
+
+
+@lru_cache(maxsize=8)
+def get_encoder(model_name: str = DEFAULT_ENCODING_MODEL):
+    """
+    tiktoken encoder 載入成本高，依模型名稱快取
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str | None, model_name: str = DEFAULT_ENCODING_MODEL) -> int:
+    if not text:
+        return 0
+    return len(get_encoder(model_name).encode(text))
+
+
+def context_budget(config: dict | None, max_tokens: int) -> int:
+    """
+    Prompt 可用的 token 數 = 模型 context 預算 - 回覆保留的 max_tokens
+    """
+    total = CONTEXT_TOKEN_BUDGET
+    if config and config.get("context_tokens"):
+        total = int(config["context_tokens"])
+    return max(total - max_tokens, 0)
+
+
+def _tokens(text: str | None, stored: int | None) -> int:
+    # 優先使用寫入時記錄的 token 數，舊資料才即時計算
+    if stored:
+        return stored + MESSAGE_OVERHEAD_TOKENS
+    return count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+
+
+# 角色設定的欄位與標題（依序輸出，空白欄位略過）
+PERSONA_FIELDS = (
+    ("age", "年齡"),
+    ("occupation", "職業"),
+    ("description", "角色介紹"),
+    ("personality", "個性"),
+    ("speaking_style", "說話風格"),
+    ("hobbies", "興趣"),
+    ("worldview", "世界觀"),
+)
+
+
+def render_persona(role) -> str | None:
+    """
+    將角色設定（Role 或含相同欄位的 Row）轉為 Prompt 中的角色區塊
+    """
+    if role is None or not role.name:
+        return None
+    lines = [f"你扮演的角色：{role.name}"]
+    for field, title in PERSONA_FIELDS:
+        value = getattr(role, field, None)
+        if value not in (None, ""):
+            lines.append(f"{title}：{value}")
+    return "\n".join(lines)
+
+
+def render_static_prefix(
+    system_prompt: str,
+    persona: str | None = None,
+    rule: str | None = None,
+    sessions_input: str | None = None,
+    pinned: list | None = None,
+) -> str:
+    """
+    Prompt 的固定前綴（同一個對話中每一輪都相同），順序由最穩定到較常變動：
+    固定指示 → 角色設定 → 對話規則 → 對話背景 → 釘選記憶（依建立順序，新釘選的接在最後）
+    """
+    sections = [system_prompt]
+    if persona:
+        sections.append(persona)
+    if rule:
+        sections.append(f"對話規則：\n{rule}")
+    if sessions_input:
+        sections.append(f"對話背景：\n{sessions_input}")
+    if pinned:
+        sections.append("重要記憶：\n" + "\n".join(f"- {m.content}" for m in pinned))
+    return "\n\n".join(sections)
+
+
+def _fit_memories(memories, budget: int) -> tuple[list, list, int]:
+    """
+    釘選（selected）記憶優先、由舊到新放入；其餘記憶由新到舊挑選，輸出時仍依建立順序排列
+    新增記憶只會接在區塊最後，不會改變前面的內容
+    """
+    pinned, recent, used = [], [], 0
+    candidates = [m for m in memories if m.content]
+    for memory in sorted((m for m in candidates if m.selected), key=lambda m: m.id):
+        cost = _tokens(memory.content, memory.token_count)
+        if used + cost <= budget:
+            pinned.append(memory)
+            used += cost
+    for memory in sorted((m for m in candidates if not m.selected), key=lambda m: -m.id):
+        cost = _tokens(memory.content, memory.token_count)
+        if used + cost <= budget:
+            recent.append(memory)
+            used += cost
+    recent.sort(key=lambda m: m.id)
+    return pinned, recent, used
+
+
+def assemble_context(
+    system_prompt: str,
+    memories: list,
+    history: list,
+    user_message: str,
+    budget: int,
+    persona: str | None = None,
+    persona_tokens: int | None = None,
+    rule: str | None = None,
+    sessions_input: str | None = None,
+) -> list[dict]:
+    """
+    組合 Prompt，固定內容在前、變動內容在後，讓供應商的 prompt caching 能命中最長的共同前綴：
+      system：固定指示、角色設定、對話規則、sessions_input、釘選記憶
+      system：其他記憶（依建立順序）
+      近期對話（舊到新）→ 使用者最新輸入
+    - 固定前綴與使用者最新輸入一定保留
+    - 記憶最多佔 CONTEXT_MEMORY_RATIO 的預算
+    - 剩餘預算由新到舊放入近期對話（history 需為新到舊排序）
+    """
+    tail = {"role": "user", "content": user_message}
+
+    static_tokens = (
+        count_tokens(system_prompt)
+        + (persona_tokens if persona_tokens is not None else count_tokens(persona))
+        + count_tokens(rule)
+        + count_tokens(sessions_input)
+        + MESSAGE_OVERHEAD_TOKENS
+    )
+    remaining = budget - static_tokens - count_tokens(user_message) - MESSAGE_OVERHEAD_TOKENS
+
+    pinned, recent, memory_tokens = _fit_memories(memories, min(remaining, int(budget * CONTEXT_MEMORY_RATIO)))
+    remaining -= memory_tokens
+
+    messages = [{"role": "system", "content": render_static_prefix(system_prompt, persona, rule, sessions_input, pinned)}]
+    if recent:
+        messages.append({"role": "system", "content": "相關記憶：\n" + "\n".join(f"- {m.content}" for m in recent)})
+
+    history_messages = []
+    for msg in history:
+        cost = _tokens(msg.message, msg.token_count)
+        if cost > remaining:
+            break  # 對話需保持連續，超出預算就停止往前取
+        remaining -= cost
+        history_messages.append({"role": msg.sender, "content": msg.message})
+    history_messages.reverse()  # 逆序，讓最新對話在最下方
+
+    return messages + history_messages + [tail]
@@ -0,0 +1,168 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass, replace
+from datetime import datetime
+from cachetools import LRUCache, TTLCache
+from models import ChatMessage
+from utils.context import CONTEXT_HISTORY_LIMIT, count_tokens, render_persona
+
+# 聊天熱資料快取：每個對話的 session 設定、近期訊息與記憶，以及模型金鑰設定
+# 新訊息寫入時增量更新，訊息 / 對話 / 記憶異動時失效，穩定狀態下送出訊息前不必查詢資料庫
+# 角色設定區塊（含 token 數）依 (role_id, 版本) 預先組好，同一角色的所有對話共用
+# 注意：快取在各程序內獨立，多 worker 部署時其他程序的異動最晚於 TTL 後生效
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", 1024))
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", 300))
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", 1024))
+
+
+@dataclass(frozen=True)
+class CachedMessage:
+    id: int
+    sender: str
+    message: str
+    token_count: int | None
+
+
+@dataclass(frozen=True)
+class CachedMemory:
+    id: int
+    content: str | None
+    token_count: int | None
+    selected: bool
+
+
+@dataclass(frozen=True)
+class CachedModelAPI:
+    id: int
+    provider: str
+    config: dict
+    user_id: int | None = None  # 金鑰擁有者，token 用量歸屬
+
+
+@dataclass(frozen=True)
+class SessionContext:
+    session_id: int
+    role_id: int
+    role_name: str | None
+    role_version: datetime | None  # Role.updated_at，角色設定快取的版本
+    rule: str | None
+    sessions_input: str | None
+    history: tuple  # CachedMessage，新到舊
+    memories: tuple  # CachedMemory
+
+
+@dataclass(frozen=True)
+class CompiledPersona:
+    role_id: int
+    version: datetime | None
+    text: str | None
+    tokens: int
+
+
+@dataclass(frozen=True)
+class ChatContext:
+    session: SessionContext | None
+    model_api: CachedModelAPI | None
+
+
+_sessions: TTLCache = TTLCache(maxsize=CONTEXT_CACHE_SIZE, ttl=CONTEXT_CACHE_TTL)
+_model_apis: TTLCache = TTLCache(maxsize=CONTEXT_CACHE_SIZE, ttl=CONTEXT_CACHE_TTL)
+# 鍵含版本，角色更新後舊版本不會再被讀到，不需要 TTL
+_personas: LRUCache = LRUCache(maxsize=PERSONA_CACHE_SIZE)
+# 部分失效來自同步路由（執行緒池），需上鎖
+_lock = threading.Lock()
+
+
+def _message(m: ChatMessage) -> CachedMessage:
+    return CachedMessage(id=m.id, sender=m.sender, message=m.message, token_count=m.token_count)
+
+
+def get_session_context(session_id: int) -> SessionContext | None:
+    with _lock:
+        return _sessions.get(session_id)
+
+
+def get_model_api(api_id: int) -> CachedModelAPI | None:
+    with _lock:
+        return _model_apis.get(api_id)
+
+
+def get_persona(role_id: int, version: datetime | None) -> CompiledPersona | None:
+    with _lock:
+        return _personas.get((role_id, version))
+
+
+def compile_persona(role_id: int, role, version: datetime | None) -> CompiledPersona:
+    """
+    組合角色區塊並計算 token 數後放入快取（role 為 Role 或含相同欄位的 Row，角色不存在時為 None）
+    """
+    text = render_persona(role)
+    persona = CompiledPersona(role_id=role_id, version=version, text=text, tokens=count_tokens(text))
+    with _lock:
+        _personas[(persona.role_id, version)] = persona
+    return persona
+
+
+def put_session_context(ctx: SessionContext):
+    with _lock:
+        _sessions[ctx.session_id] = ctx
+
+
+def put_model_api(api: CachedModelAPI):
+    with _lock:
+        _model_apis[api.id] = api
+
+
+async def warm_session(session_id: int):
+    """
+    開啟聊天頁（讀取歷史訊息）時預先載入，讓第一次送出訊息就命中快取
+    """
+    from database import AsyncSessionLocal
+    from repository import load_chat_context
+    if get_session_context(session_id) is not None:
+        return
+    try:
+        async with AsyncSessionLocal() as db:
+            loaded = await load_chat_context(db, session_id)
+            if loaded.session:
+                put_session_context(loaded.session)
+    except Exception as e:
+        logger.warning("預載對話快取失敗：%s", e, extra={"talk_id": session_id})
+
+
+def append_messages(session_id: int, messages: list[ChatMessage]):
+    """
+    新訊息寫入後增量更新快取（messages 為舊到新）
+    """
+    with _lock:
+        ctx = _sessions.get(session_id)
+        if ctx is None:
+            return
+        new = tuple(_message(m) for m in reversed(messages))
+        _sessions[session_id] = replace(ctx, history=(new + ctx.history)[:CONTEXT_HISTORY_LIMIT])
+
+
+def invalidate_session(*session_ids: int):
+    with _lock:
+        for session_id in session_ids:
+            _sessions.pop(session_id, None)
+
+
+def invalidate_model_api(api_id: int):
+    with _lock:
+        _model_apis.pop(api_id, None)
+
+
+def invalidate_role(role_id: int):
+    """
+    角色更新或刪除：移除角色設定快取，以及使用該角色的對話快取（下次載入時取得新版本）
+    """
+    with _lock:
+        for key in [k for k in _personas if k[0] == role_id]:
+            _personas.pop(key, None)
+        for session_id in [k for k, ctx in _sessions.items() if ctx.role_id == role_id]:
+            _sessions.pop(session_id, None)
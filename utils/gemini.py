@@ -0,0 +1,80 @@
+import os
+from utils.context import count_tokens
+from utils.llm_clients import get_client
+
+# Gemini 轉接：將 chat 格式的訊息（utils.context.assemble_context 的輸出）轉為 Gemini 的
+# system_instruction + contents，並在固定前綴夠大時改用 context caching（快取部分的 token 計費較低）
+# 模型由 ModelAPI.config["model"] 指定，未設定時使用 GEMINI_CHAT_MODEL
+
+GEMINI_CHAT_MODEL = os.getenv("GEMINI_CHAT_MODEL", "models/gemini-1.5-pro-latest")
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "1") == "1"
+# 供應商對 context cache 的最小 token 數（依模型而定，可由 ModelAPI.config["cache_min_tokens"] 覆寫）
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", 32768))
+# 一個 token 至多約 4 個字元，字數低於門檻的 1/4 時不必計算 token
+_CHARS_PER_TOKEN = 4
+
+
+def model_name(config: dict | None) -> str:
+    name = (config or {}).get("model") or GEMINI_CHAT_MODEL
+    return name if name.startswith("models/") else f"models/{name}"
+
+
+def to_gemini(messages: list[dict]) -> tuple[str | None, list[dict]]:
+    """
+    第一則 system 訊息作為 system_instruction；其餘 system 訊息（記憶）以 user 身分放在對話前面
+    assistant 對應 model，連續同一身分的訊息合併為同一則（Gemini 要求 user / model 交替）
+    """
+    system_instruction = None
+    contents = []
+    for i, message in enumerate(messages):
+        text = message.get("content")
+        if not text:
+            continue
+        if i == 0 and message["role"] == "system":
+            system_instruction = text
+            continue
+        role = "model" if message["role"] == "assistant" else "user"
+        if contents and contents[-1]["role"] == role:
+            contents[-1]["parts"].append(text)
+        else:
+            contents.append({"role": role, "parts": [text]})
+    return system_instruction, contents
+
+
+def generation_config(max_tokens: int | None = None, temperature: float | None = None, top_p: float | None = None,
+                      presence_penalty: float | None = None, frequency_penalty: float | None = None) -> dict:
+    config = {"max_output_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+    # 部分模型不支援 penalty，只在有設定時傳送
+    if presence_penalty:
+        config["presence_penalty"] = presence_penalty
+    if frequency_penalty:
+        config["frequency_penalty"] = frequency_penalty
+    return {key: value for key, value in config.items() if value is not None}
+
+
+def _should_cache(config: dict, system_instruction: str | None) -> bool:
+    if not GEMINI_CONTEXT_CACHE or not system_instruction:
+        return False
+    min_tokens = int(config.get("cache_min_tokens", GEMINI_CACHE_MIN_TOKENS))
+    if len(system_instruction) < min_tokens // _CHARS_PER_TOKEN:
+        return False
+    return count_tokens(system_instruction) >= min_tokens
+
+
+async def generate(model_api, messages: list[dict], config: dict | None = None, stream: bool = False):
+    """
+    呼叫 Gemini generate_content；固定前綴達到 context cache 門檻時使用（或建立）該金鑰的快取
+    回傳值與 GenerativeModel.generate_content_async 相同（stream=True 時為非同步迭代的回應）
+    """
+    client = get_client(model_api)
+    name = model_name(model_api.config)
+    system_instruction, contents = to_gemini(messages)
+
+    cached = None
+    if _should_cache(model_api.config, system_instruction):
+        cached = await client.cached_content(name, system_instruction)
+    if cached:
+        model = client.model(name, cached_content=cached, generation_config=config)
+    else:
+        model = client.model(name, system_instruction=system_instruction, generation_config=config)
+    return await model.generate_content_async(contents, stream=stream)
@@ -0,0 +1,48 @@
+import hashlib
+import json
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# 前端會持續輪詢的列表：ETag 相符時回 304（不帶 body）
+# - 有便宜的版本查詢時（如角色目錄的筆數 + 最後更新時間），以 version_etag 先比對，相符時不必查詢與組合列表
+# - 否則以回應內容的雜湊作為 ETag，只省下傳輸量
+# ETag 由資料庫內容計算，多個 worker 之間不需要共享版本號
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def version_etag(*parts) -> str:
+    """
+    由版本資訊（請求網址、資料版本等）組成 ETag
+    """
+    raw = "\x1f".join(str(part) for part in parts)
+    return '"v-' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match 採弱比對，W/ 前綴不影響
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def cached_json(request: Request, data, headers: dict | None = None, etag: str | None = None) -> Response:
+    """
+    回傳 JSON，附上 ETag（未指定時以內容雜湊計算）；If-None-Match 符合時回 304
+    Cache-Control: no-cache 讓瀏覽器每次都帶 ETag 回來驗證
+    """
+    body = json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = etag or strong_etag(body)
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urljoin
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# 角色圖片上傳：串流寫入暫存檔並計算內容雜湊，以雜湊命名（相同圖片只存一份）
+# 在 process pool 中驗證格式並產生縮圖 / WebP 版本，不佔用事件迴圈
+#   uploads/<sha256>.<ext>        原圖
+#   uploads/<sha256>.webp         WebP 版本（原圖為 WebP 時即原圖）
+#   uploads/<sha256>_thumb.webp   列表用縮圖
+# 雜湊檔名的內容永遠不變，可長期快取（見 utils/static.py）
+
+UPLOAD_DIR = "uploads"
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 5 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 40_000_000))
+IMAGE_THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", 256))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", 80))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Pillow 格式 -> 副檔名
+ALLOWED_FORMATS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+HASHED_NAME = re.compile(r"^(?P<digest>[0-9a-f]{64})(?P<variant>_thumb)?\.(?P<ext>jpg|png|gif|webp)$")
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _save_webp(image, path: str):
+    from PIL import Image
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(tmp_path, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+    os.replace(tmp_path, path)
+
+
+def _process_image(tmp_path: str, upload_dir: str, digest: str) -> str:
+    """
+    於子程序執行：驗證圖片、移到雜湊檔名並產生 WebP / 縮圖，回傳原圖檔名
+    """
+    from PIL import Image, ImageOps
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    try:
+        with Image.open(tmp_path) as image:
+            ext = ALLOWED_FORMATS.get(image.format)
+            if ext is None:
+                raise ValueError(f"不支援的圖片格式：{image.format}")
+            image.load()
+            image = ImageOps.exif_transpose(image)
+
+            filename = f"{digest}.{ext}"
+            target = os.path.join(upload_dir, filename)
+            if os.path.exists(target):
+                os.remove(tmp_path)  # 相同內容已存在
+            else:
+                os.replace(tmp_path, target)
+
+            webp_path = os.path.join(upload_dir, f"{digest}.webp")
+            if not os.path.exists(webp_path):
+                _save_webp(image, webp_path)
+            thumb_path = os.path.join(upload_dir, f"{digest}_thumb.webp")
+            if not os.path.exists(thumb_path):
+                thumb = image.copy()
+                thumb.thumbnail((IMAGE_THUMB_SIZE, IMAGE_THUMB_SIZE))
+                _save_webp(thumb, thumb_path)
+            return filename
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+async def save_upload(upload: UploadFile) -> str:
+    """
+    儲存上傳的圖片，回傳寫入 Role.image 的路徑（uploads/<sha256>.<ext>）
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    tmp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as buffer:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > IMAGE_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"圖片不可超過 {IMAGE_MAX_BYTES // 1024 // 1024} MB")
+                digest.update(chunk)
+                await run_in_threadpool(buffer.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="圖片檔案是空的")
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    loop = asyncio.get_running_loop()
+    try:
+        filename = await loop.run_in_executor(_get_pool(), _process_image, tmp_path, UPLOAD_DIR, digest.hexdigest())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="只允許上傳圖片（jpg、png、gif、webp）") from e
+    return f"{UPLOAD_DIR}/{filename}"
+
+
+def thumbnail_path(image: str | None) -> str | None:
+    """
+    列表使用的縮圖路徑；舊的非雜湊檔名圖片沒有縮圖，沿用原圖
+    """
+    if not image:
+        return image
+    match = HASHED_NAME.match(os.path.basename(image))
+    if not match:
+        return image
+    return f"{UPLOAD_DIR}/{match['digest']}_thumb.webp"
+
+
+def file_version(stat_result: os.stat_result) -> str:
+    """
+    舊的非雜湊檔名圖片以修改時間與大小作為版本
+    """
+    return hashlib.md5(f"{stat_result.st_mtime_ns}-{stat_result.st_size}".encode()).hexdigest()[:16]
+
+
+def image_url(base_url: str, image: str | None, thumbnail: bool = False) -> str | None:
+    """
+    回傳帶版本的圖片網址：雜湊檔名本身就是版本，舊檔名加上 ?v=<檔案版本>
+    內容變更時網址跟著變，圖片回應才能設為 immutable
+    """
+    if not image:
+        return None
+    path = (thumbnail_path(image) if thumbnail else image).lstrip("/")
+    url = urljoin(base_url, path)
+    if HASHED_NAME.match(os.path.basename(path)):
+        return url
+    try:
+        return f"{url}?v={file_version(os.stat(path))}"
+    except OSError:
+        return url
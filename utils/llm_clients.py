@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from cachetools import TTLCache
+
+# 供應商 client 快取：每個 ModelAPI 共用一個非同步 client（含連線池），避免每次請求重新握手
+
+logger = logging.getLogger(__name__)
+
+AZURE_API_VERSION = "2023-07-01-preview"
+
+# 連線池設定
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 20))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+# Gemini context cache：伺服器端保留秒數、每把金鑰最多記錄的快取數；本地記錄比伺服器端提早失效，避免用到剛過期的快取
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", 600))
+GEMINI_CACHE_ENTRIES = int(os.getenv("GEMINI_CACHE_ENTRIES", 256))
+GEMINI_CACHE_EXPIRY_MARGIN = 30
+
+# model_api.id -> (config hash, client)
+_clients: dict[int, tuple[str, object]] = {}
+# 已被替換或刪除、等待在事件迴圈中關閉的 client
+_retired: list[object] = []
+_lock = threading.Lock()
+
+
+class GeminiClient:
+    """
+    每把 Gemini 金鑰各自擁有一組 client，不使用全域的 genai.configure()
+    context cache 也建立在這把金鑰底下，其他金鑰無法使用
+    """
+
+    def __init__(self, api_key: str, cache_ttl: int = GEMINI_CACHE_TTL):
+        from google.generativeai import client as genai_client
+        self._manager = genai_client._ClientManager()
+        self._manager.configure(api_key=api_key)
+        self._cache_ttl = cache_ttl
+        # (模型, 內容雜湊) -> cachedContents 名稱；建立失敗記錄為 ""，TTL 內不再重試
+        self._caches: TTLCache = TTLCache(maxsize=GEMINI_CACHE_ENTRIES,
+                                          ttl=max(cache_ttl - GEMINI_CACHE_EXPIRY_MARGIN, 1))
+        self._creating: dict[tuple[str, str], asyncio.Future] = {}
+
+    def model(self, model_name: str, cached_content: str | None = None, **kwargs):
+        import google.generativeai as genai
+        model = genai.GenerativeModel(model_name, **kwargs)
+        # 綁定這把金鑰專屬的 client，避免 GenerativeModel 取用全域預設 client
+        model._async_client = self._manager.get_default_client("generative_async")
+        if cached_content:
+            # 與 GenerativeModel.from_cached_content 相同，但不經由全域 client 查詢快取
+            model._cached_content = cached_content
+        return model
+
+    async def cached_content(self, model_name: str, system_instruction: str) -> str | None:
+        """
+        取得（或建立）以 system_instruction 為內容的 context cache，回傳名稱；建立失敗時回傳 None
+        同一內容同時有多個請求時只建立一次
+        """
+        key = (model_name, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest())
+        name = self._caches.get(key)
+        if name is not None:
+            return name or None
+        future = self._creating.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._create_cache(key, model_name, system_instruction))
+            self._creating[key] = future
+            future.add_done_callback(lambda _: self._creating.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _create_cache(self, key: tuple[str, str], model_name: str, system_instruction: str) -> str | None:
+        from google.generativeai import caching
+        request = caching.CachedContent._prepare_create_request(
+            model=model_name, system_instruction=system_instruction, ttl=self._cache_ttl,
+        )
+        try:
+            response = await self._manager.get_default_client("cache_async").create_cached_content(request)
+        except Exception as e:
+            logger.warning("建立 Gemini context cache 失敗：%s", e, extra={"model": model_name})
+            self._caches[key] = ""
+            return None
+        self._caches[key] = response.name
+        logger.info("已建立 Gemini context cache", extra={"model": model_name, "cache": response.name,
+                                                         "cached_tokens": response.usage_metadata.total_token_count})
+        return response.name
+
+    def warm(self):
+        # 預先建立非同步 gRPC client（綁定目前的事件迴圈）
+        self._manager.get_default_client("generative_async")
+
+    async def close(self):
+        # 已建立的 context cache 由伺服器端依 TTL 自動刪除
+        for name in ("generative_async", "cache_async"):
+            async_client = self._manager.clients.get(name)
+            if async_client is not None:
+                await async_client.transport.close()
+
+
+def _config_hash(provider: str, config: dict) -> str:
+    raw = json.dumps({"provider": provider, "config": config}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _build_client(provider: str, config: dict):
+    if provider == "azure":
+        import httpx
+        from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+        return AsyncAzureOpenAI(
+            api_key=config["api_key"],
+            api_version=config.get("api_version", AZURE_API_VERSION),
+            azure_endpoint=config["endpoint"],
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=LLM_TIMEOUT,
+            ),
+        )
+    if provider == "gemini":
+        return GeminiClient(config["api_key"])
+    raise ValueError(f"不支援的供應商：{provider}")
+
+
+def _close_retired():
+    """
+    在事件迴圈中關閉已淘汰的 client；沒有事件迴圈時留待下次處理
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    with _lock:
+        retired = list(_retired)
+        _retired.clear()
+    for client in retired:
+        loop.create_task(client.close())
+
+
+def get_client(model_api):
+    """
+    取得 ModelAPI 對應的非同步 client；config 變更時自動重建
+    需在事件迴圈內呼叫（gRPC 非同步 channel 會綁定目前的事件迴圈）
+    """
+    config_hash = _config_hash(model_api.provider, model_api.config)
+    with _lock:
+        cached = _clients.get(model_api.id)
+        if cached and cached[0] == config_hash:
+            return cached[1]
+
+    client = _build_client(model_api.provider, model_api.config)
+    with _lock:
+        cached = _clients.get(model_api.id)
+        if cached and cached[0] == config_hash:
+            # 其他請求已先建立，使用先建立的那個
+            _retired.append(client)
+            client = cached[1]
+        else:
+            if cached:
+                _retired.append(cached[1])
+            _clients[model_api.id] = (config_hash, client)
+    _close_retired()
+    return client
+
+
+def prewarm_client(model_api):
+    """
+    啟動預熱：建立 client 並載入 SDK 延遲載入的模組，不發出任何請求
+    """
+    client = get_client(model_api)
+    if isinstance(client, GeminiClient):
+        client.warm()
+    else:
+        client.chat.completions  # openai 的 resource 在第一次存取時才載入
+    return client
+
+
+def evict_client(api_id: int):
+    """
+    金鑰更新或刪除時移除快取的 client
+    """
+    with _lock:
+        cached = _clients.pop(api_id, None)
+        if cached:
+            _retired.append(cached[1])
+    _close_retired()
+
+
+async def close_all_clients():
+    with _lock:
+        clients = [client for _, client in _clients.values()] + list(_retired)
+        _clients.clear()
+        _retired.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning("關閉模型 client 失敗：%s", e)
@@ -0,0 +1,163 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from starlette.datastructures import MutableHeaders
+from utils.metrics import LOG_RECORDS_DROPPED
+
+# 結構化日誌：每筆記錄輸出一行 JSON（LOG_FORMAT=text 時為一般文字格式）
+# - 請求執行緒只把記錄放進佇列，由背景執行緒（QueueListener）寫到 stdout，不在請求中做 I/O
+# - 佇列滿時直接丟棄，不讓日誌拖慢請求
+# - 每個請求帶 request_id（沿用 X-Request-ID 標頭或自動產生），並回傳在回應標頭
+# - DEBUG 記錄依 LOG_DEBUG_SAMPLE_RATE 抽樣
+# - Prompt 等使用者內容以 redact() 包裝，預設只記錄長度與雜湊
+# 使用方式：logger = logging.getLogger(__name__)，額外欄位放在 extra={...}
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.01))
+LOG_REDACT_PROMPTS = os.getenv("LOG_REDACT_PROMPTS", "1") == "1"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# 目前請求的 request_id；背景工作為 None
+_request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# LogRecord 內建欄位，其餘視為 extra
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener: QueueListener | None = None
+
+
+def get_request_id() -> str | None:
+    return _request_id.get()
+
+
+def redact(text: str | None) -> str | None:
+    """
+    使用者內容（Prompt、訊息）寫入日誌前的處理：預設只保留長度與雜湊，可用來比對同一段內容
+    """
+    if text is None or not LOG_REDACT_PROMPTS:
+        return text
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    return f"<redacted len={len(text)} sha256={digest}>"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    """
+    在產生記錄的執行緒中讀取 request_id（進入佇列後就讀不到 contextvar 了），並對 DEBUG 抽樣
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+        record.request_id = _request_id.get()
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging():
+    """
+    設定 root logger；重複呼叫不會重複安裝
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(name)s - [%(request_id)s] %(message)s"))
+
+    handler = _DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # DB_ECHO 時 SQLAlchemy 自帶輸出到 stdout 的 handler，不再往上傳避免重複
+    logging.getLogger("sqlalchemy.engine").propagate = False
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    停止背景執行緒並寫出佇列中剩餘的記錄
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIDMiddleware:
+    """
+    ASGI middleware：沿用用戶端（或上游 proxy）帶來的 X-Request-ID，沒有或格式不符則產生新的
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        request_id = incoming if incoming and _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = _request_id.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_id.reset(token)
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models import ChatMessage, Memory, MemoryJob, ModelAPI
+from utils.llm_clients import get_client
+from utils.context import count_tokens
+from utils import context_cache, gemini
+from utils.metrics import MEMORY_JOBS, observe_llm, record_tokens
+from utils.usage import TokenUsage, add_daily_usage, gemini_usage, openai_usage
+
+# 自動記憶生成的背景工作佇列：工作寫入 memory_jobs 資料表，重啟後會重新排入佇列
+
+logger = logging.getLogger(__name__)
+
+MEMORY_JOB_WORKERS = int(os.getenv("MEMORY_JOB_WORKERS", 2))
+MEMORY_JOB_MAX_ATTEMPTS = int(os.getenv("MEMORY_JOB_MAX_ATTEMPTS", 3))
+MEMORY_JOB_BACKOFF_SECONDS = float(os.getenv("MEMORY_JOB_BACKOFF_SECONDS", 5))
+# running 超過此秒數視為上次程序中斷留下的工作
+MEMORY_JOB_STALE_SECONDS = int(os.getenv("MEMORY_JOB_STALE_SECONDS", 600))
+
+_queue: asyncio.Queue | None = None
+_workers: list[asyncio.Task] = []
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite 取回的時間沒有時區資訊
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _schedule(job_id: int, run_at: datetime | None = None):
+    if _queue is None:
+        return  # 尚未啟動 worker，工作會在下次啟動時從資料表恢復
+    delay = (_as_utc(run_at) - _utcnow()).total_seconds() if run_at else 0
+    if delay > 0:
+        asyncio.get_running_loop().call_later(delay, _queue.put_nowait, job_id)
+    else:
+        _queue.put_nowait(job_id)
+
+
+async def enqueue_memory_job(talk_id: int, role_id: int, model_api_id: int | None, message_count: int = 5):
+    """
+    回應送出後執行：每 message_count 則訊息建立一筆摘要工作
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            total = await db.scalar(select(func.count()).select_from(ChatMessage).filter(ChatMessage.talk_id == talk_id))
+            if total % message_count != 0:
+                return None
+            job = MemoryJob(
+                session_id=talk_id,
+                role_id=role_id,
+                model_api_id=model_api_id,
+                message_count=message_count,
+                status="pending",
+                attempts=0
+            )
+            db.add(job)
+            await db.commit()
+            _schedule(job.id)
+            return job.id
+    except Exception as e:
+        logger.warning("建立記憶工作失敗：%s", e, extra={"talk_id": talk_id})
+        return None
+
+
+async def _summarise(model_api: ModelAPI, summary_prompt: list) -> tuple[str, TokenUsage]:
+    client = get_client(model_api)
+    if model_api.provider == "azure":
+        deployment = model_api.config["deployment_name"]
+        with observe_llm("azure", deployment, "memory"):
+            response = await client.chat.completions.create(
+                model=deployment,
+                messages=summary_prompt,
+                temperature=0.5,
+                max_tokens=200
+            )
+        text = response.choices[0].message.content
+        usage = openai_usage(response.usage, summary_prompt, text)
+        record_tokens("azure", deployment, usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens)
+        return text, usage
+    if model_api.provider == "gemini":
+        model_name = gemini.model_name(model_api.config).removeprefix("models/")
+        with observe_llm("gemini", model_name, "memory"):
+            result = await gemini.generate(model_api, summary_prompt,
+                                           gemini.generation_config(max_tokens=200, temperature=0.5))
+        usage = gemini_usage(result, summary_prompt, result.text)
+        record_tokens("gemini", model_name, usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens)
+        return result.text, usage
+    raise ValueError(f"不支援的供應商：{model_api.provider}")
+
+
+async def generate_memory(db: AsyncSession, job: MemoryJob) -> Memory:
+    model_api = await db.get(ModelAPI, job.model_api_id) if job.model_api_id else None
+    if not model_api:
+        raise ValueError("模型金鑰不存在")
+
+    # 抓最近 N 則訊息（新到舊）
+    recent = (await db.execute(
+        select(ChatMessage)
+        .filter(ChatMessage.talk_id == job.session_id)
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+        .limit(job.message_count)
+    )).scalars().all()
+    recent = list(reversed(recent))  # 轉成舊到新
+
+    # 組合對話內容
+    context = "\n".join([f"{m.sender}：{m.message}" for m in recent])
+
+    # 設計 Prompt
+    summary_prompt = [
+        {
+            "role": "system",
+            "content": "你是小說寫作助手，請根據以下 5 輪對話（共 10 則訊息），整理出一句具體的事件或記憶摘要（不超過 100 字），並加上 1～3 個合適的分類標籤。\n\n格式如下：\n記憶內容：...\n標籤：...\n"
+        },
+        {
+            "role": "user",
+            "content": context
+        }
+    ]
+
+    result, usage = await _summarise(model_api, summary_prompt)
+    # 用量先提交：即使回覆格式錯誤而重試，已花費的 token 也要計入
+    await add_daily_usage(db, model_api.user_id, model_api.id, "memory", usage)
+    await db.commit()
+
+    # 解析回傳內容
+    lines = result.strip().splitlines()
+    memory_text = ""
+    tags = ""
+    for line in lines:
+        if line.startswith("記憶內容："):
+            memory_text = line.replace("記憶內容：", "").strip()
+        elif line.startswith("標籤："):
+            tags = line.replace("標籤：", "").strip()
+    if not memory_text:
+        raise ValueError("模型回覆格式錯誤")
+
+    # 寫入記憶體資料表
+    memory = Memory(
+        role_id=job.role_id,
+        session_id=job.session_id,
+        content=memory_text,
+        token_count=count_tokens(memory_text),
+        tags=tags,
+        is_active=True,
+        selected=False
+    )
+    db.add(memory)
+    await db.flush()
+    return memory
+
+
+async def _run_job(job_id: int):
+    async with AsyncSessionLocal() as db:
+        # 以條件式 UPDATE 領取工作，避免多個 worker / 程序重複執行
+        claimed = await db.execute(
+            update(MemoryJob)
+            .where(MemoryJob.id == job_id, MemoryJob.status == "pending")
+            .values(status="running", attempts=MemoryJob.attempts + 1, updated_at=_utcnow())
+        )
+        await db.commit()
+        if claimed.rowcount != 1:
+            return
+
+        job = await db.get(MemoryJob, job_id)
+        try:
+            memory = await generate_memory(db, job)
+            job.status = "succeeded"
+            job.memory_id = memory.id
+            job.last_error = None
+            await db.commit()
+            context_cache.invalidate_session(job.session_id)
+            MEMORY_JOBS.labels("succeeded").inc()
+            logger.info("自動記憶生成成功", extra={"job_id": job_id, "memory_id": memory.id})
+        except Exception as e:
+            await db.rollback()
+            job = await db.get(MemoryJob, job_id)
+            job.last_error = str(e)
+            if job.attempts < MEMORY_JOB_MAX_ATTEMPTS:
+                # 指數退避後重試
+                job.status = "pending"
+                job.next_run_at = _utcnow() + timedelta(seconds=MEMORY_JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+                await db.commit()
+                _schedule(job_id, job.next_run_at)
+                MEMORY_JOBS.labels("retried").inc()
+                logger.warning("自動記憶生成失敗，稍後重試：%s", e, extra={"job_id": job_id, "attempts": job.attempts})
+            else:
+                job.status = "failed"
+                await db.commit()
+                MEMORY_JOBS.labels("failed").inc()
+                logger.error("自動記憶生成失敗，已達重試上限：%s", e, extra={"job_id": job_id, "attempts": job.attempts})
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run_job(job_id)
+        except Exception as e:
+            logger.exception("記憶工作執行錯誤", extra={"job_id": job_id})
+        finally:
+            _queue.task_done()
+
+
+async def _recover_jobs():
+    """
+    重新排入未完成的工作（包含上次程序中斷時卡在 running 的工作）
+    """
+    async with AsyncSessionLocal() as db:
+        # updated_at 由應用程式以 UTC 寫入（models.MemoryJob），與 _utcnow() 同一時間基準
+        stale_before = _utcnow() - timedelta(seconds=MEMORY_JOB_STALE_SECONDS)
+        await db.execute(
+            update(MemoryJob)
+            .where(MemoryJob.status == "running", MemoryJob.updated_at < stale_before)
+            .values(status="pending")
+        )
+        await db.commit()
+        jobs = (await db.execute(
+            select(MemoryJob.id, MemoryJob.next_run_at).filter(MemoryJob.status == "pending")
+        )).all()
+    for job_id, next_run_at in jobs:
+        _schedule(job_id, next_run_at)
+    if jobs:
+        logger.info("恢復 %d 筆記憶工作", len(jobs))
+
+
+async def start_workers():
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.Queue()
+    for _ in range(MEMORY_JOB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+    try:
+        await _recover_jobs()
+    except Exception as e:
+        logger.exception("恢復記憶工作失敗")
+
+
+async def stop_workers():
+    global _queue
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
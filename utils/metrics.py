@@ -0,0 +1,168 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+
+# Prometheus 指標：路由延遲、每個請求的 DB 查詢數與耗時、LLM 延遲 / 首字延遲 / token 用量、
+# 記憶工作結果與連線池使用量。由 /metrics 輸出
+# 每個請求的 DB 統計由 utils/sql_profiler.py 收集後寫入這裡的指標
+# 多 worker 部署時設定 PROMETHEUS_MULTIPROC_DIR，由各程序寫入共用目錄後合併輸出
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP 請求處理時間（含串流回應）",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "每個 HTTP 請求執行的 SQL 數",
+    ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "每個 HTTP 請求花在 SQL 的時間",
+    ["route"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "單一 SQL 的執行時間",
+    ["engine"], buckets=LATENCY_BUCKETS,
+)
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "模型 API 呼叫時間（串流為完整回覆時間）",
+    ["provider", "deployment", "operation", "outcome"], buckets=LLM_BUCKETS,
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "串流回覆的首字延遲",
+    ["provider", "deployment"], buckets=LLM_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "模型 token 用量",
+    ["provider", "deployment", "kind"],
+)
+MEMORY_JOBS = Counter(
+    "memory_jobs_total", "自動記憶工作執行結果",
+    ["outcome"],
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "日誌佇列已滿而丟棄的記錄數",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "連線池中使用中的連線數",
+    ["engine"], multiprocess_mode="livesum",
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size", "連線池大小（不含 overflow）",
+    ["engine"], multiprocess_mode="livesum",
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "連線池目前的 overflow 連線數（負數表示尚未用滿）",
+    ["engine"], multiprocess_mode="livesum",
+)
+
+
+# 指標標籤用的引擎名稱（primary / read）與其連線池
+_engine_names: dict[int, str] = {}
+_pools: dict[str, object] = {}
+
+
+def route_name(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def observe_query(engine, seconds: float):
+    DB_QUERY_DURATION.labels(_engine_names.get(id(engine), engine.url.get_backend_name())).observe(seconds)
+
+
+def observe_request_db(route: str, queries: int, seconds: float):
+    DB_QUERIES_PER_REQUEST.labels(route).observe(queries)
+    DB_TIME_PER_REQUEST.labels(route).observe(seconds)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware：量測到回應內容全部送出為止（含串流回應與背景工作）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(scope["method"], route_name(scope), str(status["code"])).observe(
+                time.perf_counter() - started
+            )
+            _update_pool_gauges()
+
+
+@contextmanager
+def observe_llm(provider: str, deployment: str | None, operation: str):
+    """
+    記錄一次模型呼叫的耗時與成功 / 失敗
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        LLM_REQUEST_DURATION.labels(provider, deployment or "", operation, outcome).observe(time.perf_counter() - started)
+
+
+def observe_ttft(provider: str, deployment: str | None, seconds: float):
+    LLM_TIME_TO_FIRST_TOKEN.labels(provider, deployment or "").observe(seconds)
+
+
+def record_tokens(provider: str, deployment: str | None, prompt_tokens: int | None, completion_tokens: int | None,
+                  cached_tokens: int | None = None):
+    """
+    prompt cache 命中率 = kind="cached_prompt" / kind="prompt"
+    """
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, deployment or "", "prompt").inc(prompt_tokens)
+        # 先建立標籤，沒有命中時命中率為 0 而不是沒有資料
+        LLM_TOKENS.labels(provider, deployment or "", "cached_prompt").inc(cached_tokens or 0)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, deployment or "", "completion").inc(completion_tokens)
+
+
+def register_engine(name: str, engine):
+    """
+    註冊要回報連線池使用量的引擎（AsyncEngine 傳入 .sync_engine）
+    """
+    _engine_names[id(engine)] = name
+    if hasattr(engine.pool, "checkedout"):
+        _pools[name] = engine.pool
+
+
+def _update_pool_gauges():
+    # 每個請求結束與抓取 /metrics 時更新（多程序模式下各程序寫入自己的數值）
+    for name, pool in _pools.items():
+        DB_POOL_CHECKED_OUT.labels(name).set(pool.checkedout())
+        DB_POOL_SIZE.labels(name).set(pool.size())
+        DB_POOL_OVERFLOW.labels(name).set(pool.overflow())
+
+
+def metrics_response() -> Response:
+    _update_pool_gauges()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,82 @@
+import json
+import os
+from typing import Callable, Literal, MutableMapping, Optional
+from fastapi import Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from database import AsyncReadSessionLocal
+
+# 列表 API 的游標分頁與 NDJSON 匯出
+# 依主鍵遞增排序，游標為上一頁最後一筆的 id，下一頁游標放在 X-Next-Cursor 標頭（沒有下一頁則不回傳）
+
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", 100))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", 500))
+# NDJSON 匯出時每批從資料庫取回的筆數
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 500))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class ListParams:
+    """
+    列表 API 共用的查詢參數：limit、cursor、format（json / ndjson）
+    ndjson 會串流輸出所有符合條件的資料（不套用 limit）
+    """
+
+    def __init__(
+        self,
+        limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+        cursor: Optional[int] = Query(None, description="上一頁最後一筆的 id"),
+        format: Literal["json", "ndjson"] = Query("json"),
+    ):
+        self.limit = limit
+        self.cursor = cursor
+        self.format = format
+
+
+def apply_filters(stmt, model, **filters):
+    """
+    值為 None 的條件略過，其餘以等號比對同名欄位
+    """
+    for name, value in filters.items():
+        if value is not None:
+            stmt = stmt.filter(getattr(model, name) == value)
+    return stmt
+
+
+def after_cursor(stmt, id_column, cursor: Optional[int]):
+    if cursor is not None:
+        stmt = stmt.filter(id_column > cursor)
+    return stmt.order_by(id_column)
+
+
+def page(rows: list, limit: int, headers: MutableMapping) -> list:
+    """
+    查詢時多取一筆（limit + 1）判斷是否有下一頁，下一頁游標寫入 headers
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
+    return rows
+
+
+def ndjson_response(stmt, serialize: Callable | type[BaseModel], entities: bool = True) -> StreamingResponse:
+    """
+    以 yield_per 分批讀取並逐行輸出，記憶體用量不隨資料表大小成長
+    serialize 可為輸出用的 Pydantic schema，或自訂的轉換函式
+    entities=False 表示查詢的是欄位投影，serialize 收到的是 Row
+    路由的 DB Session 在回應送出前就會關閉，因此串流自行開一個（唯讀）Session
+    """
+    if isinstance(serialize, type) and issubclass(serialize, BaseModel):
+        schema = serialize
+        serialize = lambda row: schema.model_validate(row, from_attributes=True)
+
+    async def generate():
+        async with AsyncReadSessionLocal() as db:
+            result = await db.stream(stmt.execution_options(yield_per=EXPORT_YIELD_PER))
+            async for row in (result.scalars() if entities else result):
+                yield json.dumps(jsonable_encoder(serialize(row)), ensure_ascii=False) + "\n"
+                if entities:
+                    db.expunge(row)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -0,0 +1,124 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from utils.metrics import observe_query, observe_request_db, route_name
+
+# 每個請求的 SQL 分析：以 before/after_cursor_execute 統計查詢數與耗時
+# - 單一 SQL 超過 SQL_SLOW_QUERY_MS 記錄為慢查詢
+# - 同一條 SQL 在一個請求內執行 SQL_DUPLICATE_THRESHOLD 次以上視為 N+1
+# - 路由可用 query_budget(n) 宣告查詢上限，超過時記錄警告
+# - SQL_PROFILE_HEADERS=1（除錯用）時回應附上 X-DB-Queries / X-DB-Time
+
+logger = logging.getLogger(__name__)
+
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", 200))
+SQL_DUPLICATE_THRESHOLD = int(os.getenv("SQL_DUPLICATE_THRESHOLD", 3))
+SQL_PROFILE_HEADERS = os.getenv("SQL_PROFILE_HEADERS", "0") == "1"
+
+
+@dataclass
+class RequestDBStats:
+    scope: dict
+    queries: int = 0
+    duration: float = 0.0
+    budget: int | None = None
+    # SQL（已參數化）-> 執行次數
+    statements: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def route(self) -> str:
+        return f"{self.scope['method']} {route_name(self.scope)}"
+
+
+# 目前請求的 DB 統計；不在請求內（背景工作）時為 None
+_request_db_stats: ContextVar[RequestDBStats | None] = ContextVar("request_db_stats", default=None)
+
+
+def current_stats() -> RequestDBStats | None:
+    return _request_db_stats.get()
+
+
+def _short(statement: str, limit: int = 300) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "…"
+
+
+# 開始時間記在每次執行的 ExecutionContext 上：SQL 失敗時 after_cursor_execute 不會觸發，
+# 若記在連線上，殘留的開始時間會與之後的查詢錯配
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_start", None)
+    if started is None:
+        return  # 方言初始化等內部查詢沒有 ExecutionContext，不列入統計
+    elapsed = time.perf_counter() - started
+    observe_query(conn.engine, elapsed)
+    stats = _request_db_stats.get()
+    if elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+        logger.warning("慢查詢 %.0f ms（%s）：%s", elapsed * 1000, stats.route if stats else "背景工作", _short(statement))
+    if stats is not None:
+        stats.queries += 1
+        stats.duration += elapsed
+        stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+
+def query_budget(limit: int):
+    """
+    宣告路由的查詢上限，例如 @router.get(..., dependencies=[query_budget(2)])
+    """
+    def set_budget():
+        stats = _request_db_stats.get()
+        if stats is not None:
+            stats.budget = limit
+    return Depends(set_budget)
+
+
+def _report(stats: RequestDBStats):
+    observe_request_db(route_name(stats.scope), stats.queries, stats.duration)
+    for statement, count in stats.statements.items():
+        if count >= SQL_DUPLICATE_THRESHOLD:
+            logger.warning("重複查詢 %d 次，可能是 N+1（%s）：%s", count, stats.route, _short(statement))
+    if stats.budget is not None and stats.queries > stats.budget:
+        logger.warning("超過查詢上限 %d/%d（%s）", stats.queries, stats.budget, stats.route)
+
+
+class SQLProfilerMiddleware:
+    """
+    ASGI middleware：統計到回應內容全部送出為止（含串流回應與背景工作）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestDBStats(scope=scope)
+        token = _request_db_stats.set(stats)
+
+        async def send_wrapper(message):
+            if SQL_PROFILE_HEADERS and message["type"] == "http.response.start":
+                # 串流回應只計算到開始回應為止
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Queries"] = str(stats.queries)
+                headers["X-DB-Time"] = f"{stats.duration * 1000:.1f}ms"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_db_stats.reset(token)
+            _report(stats)
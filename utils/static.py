@@ -0,0 +1,111 @@
+import os
+import re
+import stat
+from urllib.parse import parse_qs
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+from utils.images import HASHED_NAME, file_version
+
+# 上傳圖片的靜態檔服務：
+# - 雜湊檔名與帶 ?v= 版本的網址回傳 Cache-Control: immutable，瀏覽器 / CDN 不必再回源驗證
+# - 強 ETag（雜湊檔名即內容版本）、If-None-Match 回 304
+# - Range 請求（Starlette 的 FileResponse 不支援）
+# - 瀏覽器接受 WebP 時，jpg / png 原圖改回傳預先產生的 WebP 版本
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+RANGE_CHUNK_SIZE = 64 * 1024
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _byte_range(request_headers: Headers, etag: str, size: int) -> tuple[int, int] | None:
+    """
+    解析單一範圍的 Range 標頭，回傳 (start, end)（含 end）；不需要部分回應時回傳 None
+    """
+    header = request_headers.get("range")
+    if not header:
+        return None
+    if_range = request_headers.get("if-range")
+    if if_range and if_range.strip() != etag:
+        return None  # 檔案已變更，回傳完整內容
+    match = BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None  # 多段範圍或格式不符：忽略 Range
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            start = size
+    if start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _iter_file(path: str, start: int, end: int):
+    async with await anyio.open_file(path, "rb") as file:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class ImageFiles(StaticFiles):
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        match = HASHED_NAME.match(os.path.basename(path))
+        # GIF 的 WebP 版本只有第一格，不替換
+        negotiable = bool(match and not match["variant"] and match["ext"] in ("jpg", "png"))
+        if negotiable and "image/webp" in Headers(scope=scope).get("accept", ""):
+            webp_path = os.path.join(os.path.dirname(path), f"{match['digest']}.webp")
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, webp_path)
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["vary"] = "Accept"
+                return response
+        response = await super().get_response(path, scope)
+        if negotiable:
+            response.headers["vary"] = "Accept"
+        return response
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+        if HASHED_NAME.match(name):
+            etag, immutable = f'"{name}"', True
+        else:
+            version = file_version(stat_result)
+            requested = parse_qs(scope.get("query_string", b"").decode()).get("v", [None])[0]
+            etag, immutable = f'"{version}"', requested == version
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = etag
+        response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        response.headers["accept-ranges"] = "bytes"
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        byte_range = _byte_range(request_headers, etag, stat_result.st_size)
+        if byte_range is None:
+            return response
+        start, end = byte_range
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key in ("etag", "cache-control", "accept-ranges", "last-modified", "content-type")
+        }
+        headers["content-range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+        headers["content-length"] = str(end - start + 1)
+        if scope["method"] == "HEAD":
+            return Response(status_code=206, headers=headers)
+        return StreamingResponse(_iter_file(full_path, start, end), status_code=206, headers=headers)
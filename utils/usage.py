@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import TokenUsageDaily
+from utils.context import MESSAGE_OVERHEAD_TOKENS, count_tokens
+
+# 模型呼叫的 token 用量：優先採用供應商回報的數字，沒有時以 tiktoken 在本地估算
+# 每次呼叫後以 upsert 累加到 token_usage_daily（聊天用量與訊息在同一個交易寫入），報表不需掃描 chat_messages
+# 用量歸屬於模型金鑰的擁有者
+
+
+@dataclass(frozen=True)
+class TokenUsage:
+    prompt_tokens: int
+    completion_tokens: int
+    # prompt 中命中供應商 prompt cache 的部分（已包含在 prompt_tokens 內）
+    cached_tokens: int = 0
+
+
+def local_usage(prompt_messages: list[dict], completion: str | None) -> TokenUsage:
+    return TokenUsage(
+        prompt_tokens=sum(count_tokens(m.get("content")) + MESSAGE_OVERHEAD_TOKENS for m in prompt_messages),
+        completion_tokens=count_tokens(completion),
+    )
+
+
+def openai_usage(usage, prompt_messages: list[dict], completion: str | None) -> TokenUsage:
+    """
+    Azure / OpenAI 回應的 usage；串流且未開啟 include_usage 時為 None
+    """
+    if usage is None:
+        return local_usage(prompt_messages, completion)
+    details = getattr(usage, "prompt_tokens_details", None)
+    return TokenUsage(
+        prompt_tokens=usage.prompt_tokens or 0,
+        completion_tokens=usage.completion_tokens or 0,
+        cached_tokens=getattr(details, "cached_tokens", None) or 0,
+    )
+
+
+def gemini_usage(result, prompt_messages: list[dict], completion: str | None) -> TokenUsage:
+    """
+    Gemini 回應的 usage_metadata（串流回應需在讀完後才有）
+    """
+    usage = getattr(result, "usage_metadata", None)
+    if not usage or not usage.prompt_token_count:
+        return local_usage(prompt_messages, completion)
+    return TokenUsage(
+        prompt_tokens=usage.prompt_token_count,
+        completion_tokens=usage.candidates_token_count or 0,
+        cached_tokens=getattr(usage, "cached_content_token_count", None) or 0,
+    )
+
+
+async def add_daily_usage(db: AsyncSession, user_id: int | None, model_api_id: int, kind: str, usage: TokenUsage):
+    """
+    累加到當日彙總；不 commit，由呼叫端與訊息一起提交
+    """
+    if user_id is None:
+        return
+    table = TokenUsageDaily.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table).values(
+        day=datetime.now(timezone.utc).date(),
+        user_id=user_id,
+        model_api_id=model_api_id,
+        kind=kind,
+        requests=1,
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        cached_prompt_tokens=usage.cached_tokens,
+    )
+    increments = {
+        "requests": table.c.requests + 1,
+        "prompt_tokens": table.c.prompt_tokens + usage.prompt_tokens,
+        "completion_tokens": table.c.completion_tokens + usage.completion_tokens,
+        "cached_prompt_tokens": table.c.cached_prompt_tokens + usage.cached_tokens,
+        "updated_at": func.now(),
+    }
+    if dialect == "mysql":
+        stmt = stmt.on_duplicate_key_update(**increments)
+    else:
+        stmt = stmt.on_conflict_do_update(index_elements=["user_id", "day", "model_api_id", "kind"], set_=increments)
+    await db.execute(stmt)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+from sqlalchemy import select, text
+from database import AsyncSessionLocal, async_engine, async_read_engine, engine, read_engine
+from models import ModelAPI
+from utils.context import DEFAULT_ENCODING_MODEL, get_encoder
+from utils.llm_clients import prewarm_client
+
+# 啟動預熱：服務開始接受連線後於背景同時執行，完成前 /readyz 回 503（負載平衡器不會導入流量）
+# - 載入模型 SDK（openai、google.generativeai 的 import 需要數秒）
+# - 載入 tiktoken encoder
+# - 建立最近使用的模型金鑰 client（不發出請求）
+# - 預先建立資料庫連線池中的連線
+# 個別項目失敗只記錄警告，第一次請求時仍會照常載入
+
+logger = logging.getLogger(__name__)
+
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# 預先建立 client 的金鑰數（依 id 由新到舊）
+WARMUP_MODEL_APIS = int(os.getenv("WARMUP_MODEL_APIS", 20))
+# 每個引擎預先建立的連線數（不超過連線池大小）
+WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", 5))
+# 預熱最長等待秒數，逾時仍回報 ready（未完成的項目繼續在背景執行）
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 60))
+
+
+def _import_sdks():
+    import openai  # noqa: F401
+    import google.generativeai  # noqa: F401
+
+
+def _load_encoders():
+    get_encoder(DEFAULT_ENCODING_MODEL).encode("warmup")
+
+
+async def _warm_clients():
+    async with AsyncSessionLocal() as db:
+        apis = (await db.execute(
+            select(ModelAPI).filter(ModelAPI.is_active == True).order_by(ModelAPI.id.desc()).limit(WARMUP_MODEL_APIS)
+        )).scalars().all()
+    # get_client 需在事件迴圈內呼叫（gRPC 非同步 channel 綁定事件迴圈）
+    for api in apis:
+        prewarm_client(api)
+
+
+def _connections(pool) -> int:
+    size = pool.size() if hasattr(pool, "size") else 1
+    return max(1, min(WARMUP_DB_CONNECTIONS, size))
+
+
+async def _warm_async_pool(async_engine_):
+    async def connect():
+        async with async_engine_.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+            # 同時持有，才會建立多條連線
+            await asyncio.sleep(0.05)
+    await asyncio.gather(*(connect() for _ in range(_connections(async_engine_.sync_engine.pool))))
+
+
+def _warm_sync_pool(engine_):
+    connections = [engine_.connect() for _ in range(_connections(engine_.pool))]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def _step(name: str, work):
+    started = time.perf_counter()
+    try:
+        await work
+    except Exception as e:
+        logger.warning("預熱失敗 %s：%s", name, e, extra={"step": name})
+        return
+    ms = round((time.perf_counter() - started) * 1000)
+    logger.info("預熱完成 %s（%d ms）", name, ms, extra={"step": name, "ms": ms})
+
+
+async def _sdks_then_clients():
+    # SDK 在執行緒中載入完才建立 client，避免在事件迴圈中 import
+    await _step("sdk_imports", asyncio.to_thread(_import_sdks))
+    await _step("model_clients", _warm_clients())
+
+
+async def warm_up():
+    started = time.perf_counter()
+    steps = [
+        _sdks_then_clients(),
+        _step("tiktoken", asyncio.to_thread(_load_encoders)),
+        _step("db_pool", _warm_async_pool(async_engine)),
+        _step("db_pool_sync", asyncio.to_thread(_warm_sync_pool, engine)),
+    ]
+    if read_engine is not engine:
+        steps.append(_step("db_read_pool", _warm_async_pool(async_read_engine)))
+        steps.append(_step("db_read_pool_sync", asyncio.to_thread(_warm_sync_pool, read_engine)))
+    _, pending = await asyncio.wait([asyncio.ensure_future(step) for step in steps], timeout=WARMUP_TIMEOUT)
+    if pending:
+        logger.warning("啟動預熱逾時，%d 個項目在背景繼續執行", len(pending), extra={"timeout": WARMUP_TIMEOUT})
+        return
+    ms = round((time.perf_counter() - started) * 1000)
+    logger.info("啟動預熱完成（%d ms）", ms, extra={"ms": ms})